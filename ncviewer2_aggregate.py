@@ -0,0 +1,282 @@
+import os
+import glob
+from collections import OrderedDict
+import numpy as np
+import cftime
+from netCDF4 import Dataset
+
+from ncviewer2_cache import cacheFile, loadJSON, saveJSON
+from ncviewer2_header import CachedDataset
+
+# Files of an aggregated dataset kept open at once. Others are reopened when
+# read, so series of hundreds of files don't run out of file descriptors.
+MAX_OPEN_FILES = 64
+
+def isAggregate(path):
+# A directory or a glob pattern opens as an aggregated dataset.
+    return os.path.isdir(path) or glob.has_magic(path)
+
+def openDataset(path, progress=None):
+# CachedDataset of a netCDF file, or AggregatedDataset of a directory or
+# glob pattern.
+    if isAggregate(path):
+        return AggregatedDataset(path, progress)
+    return CachedDataset(path)
+
+def seriesFiles(pattern):
+# Absolute paths of the netCDF files of a directory or glob pattern, sorted
+    if os.path.isdir(pattern):
+        files = glob.glob(os.path.join(pattern, "*.nc")) \
+            + glob.glob(os.path.join(pattern, "*.nc4"))
+    else:
+        files = glob.glob(pattern)
+    return sorted(os.path.abspath(path) for path in files if os.path.isfile(path))
+
+class FilePool():
+# Open netCDF files, at most maxOpen of them. Opening one more closes the
+# least recently used.
+    def __init__(self, maxOpen=MAX_OPEN_FILES):
+        self.maxOpen = maxOpen
+        self.handles = OrderedDict()
+
+    def get(self, path):
+        handle = self.handles.get(path)
+        if handle is not None:
+            self.handles.move_to_end(path)
+            return handle
+        while len(self.handles) >= self.maxOpen:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        handle = Dataset(path)
+        self.handles[path] = handle
+        return handle
+
+    def close(self):
+        while self.handles:
+            _, handle = self.handles.popitem()
+            handle.close()
+
+def timeDimension(obj):
+# Dimension files are joined along: the unlimited one, else "time".
+    for name, dim in obj.dimensions.items():
+        if dim.isunlimited():
+            return name
+    if "time" in obj.dimensions:
+        return "time"
+    raise ValueError("No unlimited or time dimension to join files along.")
+
+def readTimes(obj, timeDim, units, calendar):
+# Time coordinate of one file in the given units. Files may use their own
+# "<units> since <date>"; files without a coordinate count time steps.
+    if timeDim not in obj.variables:
+        return [float(i) for i in range(len(obj.dimensions[timeDim]))]
+    var = obj.variables[timeDim]
+    values = np.ma.filled(np.ma.asarray(var[:], dtype=np.float64), np.nan)
+    fileUnits = getattr(var, "units", units)
+    if fileUnits != units and " since " in units:
+        dates = cftime.num2date(values, fileUnits, calendar)
+        values = np.asarray(cftime.date2num(dates, units, calendar),
+            dtype=np.float64)
+    return values.tolist()
+
+def timeIndex(files, pool, progress=None):
+# Time index of a series: for every file its path, size, mtime and time
+# values, in the units of the first file, ordered by time. It is saved
+# under CACHE_DIR, and files whose size and mtime haven't changed since
+# are not opened again. progress(filesDone, numFiles) is called per file.
+    first = pool.get(files[0])
+    timeDim = timeDimension(first)
+    timeVar = first.variables.get(timeDim)
+    units = getattr(timeVar, "units", "")
+    calendar = getattr(timeVar, "calendar", "standard")
+
+    path = cacheFile("series", "\n".join(files))
+    saved = loadJSON(path)
+    if saved is None or (saved["timeDim"], saved["units"], saved["calendar"]) \
+        != (timeDim, units, calendar):
+        saved = {"files": []}
+    savedEntries = {entry["path"]: entry for entry in saved["files"]}
+
+    entries = []
+    changed = len(savedEntries) != len(files)
+    for numDone, filename in enumerate(files):
+        stat = os.stat(filename)
+        entry = savedEntries.get(filename)
+        if entry is None or entry["size"] != stat.st_size \
+            or entry["mtime"] != stat.st_mtime:
+            entry = {"path": filename, "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "values": readTimes(pool.get(filename), timeDim, units,
+                    calendar)}
+            changed = True
+        entries.append(entry)
+        if progress:
+            progress(numDone + 1, len(files))
+
+    if timeVar is not None:
+        # Files in time order; names like "sst_1.nc, sst_10.nc" sort wrong.
+        entries.sort(key=lambda entry: entry["values"][0]
+            if entry["values"] else np.inf)
+    index = {"timeDim": timeDim, "units": units, "calendar": calendar,
+        "files": entries}
+    if changed:
+        saveJSON(path, index)
+    return index
+
+class AggregatedDataset():
+# Files of a directory or glob pattern seen as one netCDF dataset joined
+# along their time dimension, with the ncattrs/variables/dimensions of a
+# netCDF4 Dataset. Attributes and variables without the time dimension come
+# from the first file. Files are only opened when read, through a FilePool.
+    def __init__(self, pattern, progress=None, maxOpen=MAX_OPEN_FILES):
+        self.files = seriesFiles(pattern)
+        if not self.files:
+            raise ValueError("No nc files in " + pattern)
+        self.pool = FilePool(maxOpen)
+        index = timeIndex(self.files, self.pool, progress)
+        self.timeDim = index["timeDim"]
+        self.paths = [entry["path"] for entry in index["files"]]
+        lengths = [len(entry["values"]) for entry in index["files"]]
+        # First time step of each file, and the total at the end
+        self.offsets = np.cumsum([0] + lengths)
+        self.timeValues = np.array(
+            [value for entry in index["files"] for value in entry["values"]],
+            dtype=np.float64)
+
+        first = self.pool.get(self.paths[0])
+        self.attributes = OrderedDict((name, first.getncattr(name))
+            for name in first.ncattrs())
+        self.dimensions = OrderedDict((name, len(dim))
+            for name, dim in first.dimensions.items())
+        self.dimensions[self.timeDim] = int(self.offsets[-1])
+        self.variables = OrderedDict((name, AggregatedVariable(self, name))
+            for name in first.variables)
+
+    def ncattrs(self):
+        return list(self.attributes)
+
+    def getncattr(self, name):
+        return self.attributes[name]
+
+    def fileVariable(self, fileIndex, name):
+        return self.pool.get(self.paths[fileIndex]).variables[name]
+
+    def locate(self, points):
+        # (file index, range of time steps in the file) holding each part of
+        # points, a range with a positive step, in order.
+        parts = []
+        for i in range(len(self.paths)):
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            first = max(0, -(-(start - points.start) // points.step))
+            last = min(len(points), -(-(stop - points.start) // points.step))
+            if first < last:
+                parts.append((i, range(points[first] - start,
+                    points[last - 1] - start + 1, points.step)))
+        return parts
+
+    def close(self):
+        self.pool.close()
+
+class AggregatedVariable():
+# Variable of an AggregatedDataset. Reads along the time dimension are
+# split over the files holding the time steps; other variables are read from
+# the first file. The time coordinate itself comes from the time index.
+    def __init__(self, dataset, name):
+        var = dataset.fileVariable(0, name)
+        self.dataset = dataset
+        self.name = name
+        self.dimensions = var.dimensions
+        self.dtype = var.dtype
+        self.axis = var.dimensions.index(dataset.timeDim) \
+            if dataset.timeDim in var.dimensions else None
+        shape = list(var.shape)
+        if self.axis is not None:
+            shape[self.axis] = dataset.dimensions[dataset.timeDim]
+        self.shape = tuple(shape)
+        self.ndim = len(shape)
+        # Chunk cache set on the file variables before they are read
+        self.chunkCache = None
+
+    def template(self):
+        return self.dataset.fileVariable(0, self.name)
+
+    def ncattrs(self):
+        return self.template().ncattrs()
+
+    def getncattr(self, name):
+        return self.template().getncattr(name)
+
+    def __getattr__(self, name):
+        # netCDF attributes, like var.units on a netCDF4 variable
+        if name.startswith("__") or name in ("dataset", "name"):
+            raise AttributeError(name)
+        return self.getncattr(name)
+
+    def chunking(self):
+        return self.template().chunking()
+
+    def filters(self):
+        return self.template().filters()
+
+    def get_var_chunk_cache(self):
+        return self.chunkCache or self.template().get_var_chunk_cache()
+
+    def set_var_chunk_cache(self, size, nelems, preemption):
+        self.chunkCache = (size, nelems, preemption)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __str__(self):
+        return (str(self.template()) + "\naggregated over "
+            + str(len(self.dataset.paths)) + " files along "
+            + self.dataset.timeDim + ", shape = " + str(self.shape))
+
+    def __getitem__(self, key):
+        if self.axis is None:
+            return self.template()[key]
+        key = key if isinstance(key, tuple) else (key,)
+        if any(entry is Ellipsis for entry in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) \
+                + key[i + 1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        timeKey = key[self.axis]
+        numTimes = self.shape[self.axis]
+        if isinstance(timeKey, slice):
+            points = range(*timeKey.indices(numTimes))
+        else:
+            index = int(timeKey)
+            points = range(numTimes)[index:index + 1 if index != -1 else None]
+            if len(points) == 0:
+                raise IndexError("index " + str(index) + " is out of bounds")
+        reverse = points.step < 0
+        if reverse:
+            points = points[::-1]
+        # Integer keys before the time dimension drop their dimensions.
+        axis = self.axis - sum(not isinstance(entry, slice)
+            for entry in key[:self.axis])
+
+        if self.name == self.dataset.timeDim and self.ndim == 1:
+            data = np.ma.masked_array(self.dataset.timeValues[points.start:
+                points.stop:points.step])
+        else:
+            parts = []
+            for fileIndex, local in self.dataset.locate(points):
+                var = self.dataset.fileVariable(fileIndex, self.name)
+                if self.chunkCache:
+                    var.set_var_chunk_cache(*self.chunkCache)
+                fileKey = list(key)
+                fileKey[self.axis] = slice(local.start, local.stop, local.step)
+                parts.append(var[tuple(fileKey)])
+            if not parts:
+                fileKey = list(key)
+                fileKey[self.axis] = slice(0, 0)
+                parts.append(self.template()[tuple(fileKey)])
+            data = np.ma.concatenate(parts, axis=axis) if len(parts) > 1 \
+                else parts[0]
+        if reverse:
+            data = np.flip(data, axis)
+        if not isinstance(timeKey, slice):
+            data = np.take(data, 0, axis=axis)
+        return data
@@ -0,0 +1,253 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+from netCDF4 import Dataset
+import numpy as np
+
+from ncviewer2_sied import sied2, windowStarts, tileFrontsKernel, NumbaThreads
+from ncviewer2_filters import nanMedianFilter, bandedFilter, medianHalo
+
+# sied2 parameters used when siedArgs does not give them all, the same as
+# the GUI dashboard and the command line defaults.
+SIED_DEFAULTS = (16, 8, 32, 0.3, 0.3, 0.7, 0.87, 0.87, 0.89)
+
+# Shared memory slots attached by each worker process.
+workerSlots = {}
+
+def initWorker(inputNames, outputNames, shape):
+# Attach every shared memory slot once per worker, not once per slice.
+    workerSlots["shape"] = shape
+    workerSlots["input"] = [shared_memory.SharedMemory(name=name)
+        for name in inputNames]
+    workerSlots["output"] = [shared_memory.SharedMemory(name=name)
+        for name in outputNames]
+
+def siedSlot(slot, filterSize, siedArgs):
+# Detect fronts on the slice held in one shared memory slot.
+    shape = workerSlots["shape"]
+    image = np.ndarray(shape, dtype=np.float32,
+        buffer=workerSlots["input"][slot].buf)
+    front = np.ndarray(shape, dtype=np.uint8,
+        buffer=workerSlots["output"][slot].buf)
+    # One thread per worker; the pool already keeps every core busy.
+    with NumbaThreads(1):
+        filtered = bandedFilter(nanMedianFilter, image, medianHalo(filterSize),
+            1, size=filterSize)
+    front[...] = sied2(filtered, *siedArgs)
+    return slot
+
+def maskImage(data, varMin=None, varMax=None):
+# float32 image with NaN for masked values, since the NaN-aware median
+# filter and SIED expect NaN rather than a mask, and for values out of
+# [varMin, varMax].
+    image = np.ma.filled(data.astype(np.float32), np.nan)
+    if varMin is not None:
+        image[image < varMin] = np.nan
+    if varMax is not None:
+        image[image > varMax] = np.nan
+    return image
+
+def createOutput(inObj, varName, outFilename, frontName, chunkSizes=None):
+# Output file with the variable's dimensions, their coordinate variables and
+# one uint8 front mask per 2D slice.
+    var = inObj.variables[varName]
+    outObj = Dataset(outFilename, "w")
+    for dimName in var.dimensions:
+        dim = inObj.dimensions[dimName]
+        outObj.createDimension(dimName, None if dim.isunlimited() else len(dim))
+        if dimName in inObj.variables:
+            coord = inObj.variables[dimName]
+            outCoord = outObj.createVariable(dimName, coord.dtype,
+                coord.dimensions)
+            outCoord.setncatts({attr: coord.getncattr(attr)
+                for attr in coord.ncattrs() if attr != "_FillValue"})
+            outCoord[:] = coord[:]
+    if chunkSizes is None:
+        chunkSizes = [1] * (len(var.shape) - 2) + list(var.shape[-2:])
+    front = outObj.createVariable(frontName, "u1", var.dimensions, zlib=True,
+        chunksizes=chunkSizes)
+    front.long_name = "SIED front mask of " + varName
+    return outObj, front
+
+def siedBatch(inFilename, varName, outFilename, filterSize=5, numWorkers=None,
+    maxInFlight=None, chunkSize=None, varMin=None, varMax=None,
+    frontName=None, siedArgs=()):
+# Run median filter + sied2 on every 2D slice of a 3D/4D variable and write
+# one front mask per slice. The leading dimensions are read chunkSize steps
+# at a time and slices go to worker processes through shared memory, so at
+# most maxInFlight slices are held in shared memory at once.
+    numWorkers = numWorkers or os.cpu_count() or 1
+    maxInFlight = maxInFlight or 2 * numWorkers
+    chunkSize = chunkSize or maxInFlight
+    frontName = frontName or varName + "_front"
+    siedArgs = tuple(siedArgs) + SIED_DEFAULTS[len(siedArgs):]
+
+    inObj = Dataset(inFilename)
+    var = inObj.variables[varName]
+    if len(var.shape) < 3:
+        inObj.close()
+        raise ValueError("Batch SIED needs a variable with 3 or more dimensions.")
+    shape = var.shape[-2:]
+    numPixels = shape[0] * shape[1]
+    outObj, front = createOutput(inObj, varName, outFilename, frontName)
+
+    inputSlots = [shared_memory.SharedMemory(create=True, size=numPixels * 4)
+        for _ in range(maxInFlight)]
+    outputSlots = [shared_memory.SharedMemory(create=True, size=numPixels)
+        for _ in range(maxInFlight)]
+    freeSlots = list(range(maxInFlight))
+    pending = {}
+    numDone = 0
+
+    def collect(futures):
+        nonlocal numDone
+        for future in futures:
+            slot, index = pending.pop(future)
+            future.result()
+            front[index] = np.ndarray(shape, dtype=np.uint8,
+                buffer=outputSlots[slot].buf)
+            freeSlots.append(slot)
+            numDone += 1
+
+    try:
+        with ProcessPoolExecutor(numWorkers, initializer=initWorker,
+            initargs=([s.name for s in inputSlots],
+                [s.name for s in outputSlots], shape)) as pool:
+            for start in range(0, var.shape[0], chunkSize):
+                # Read a chunk of time steps at once.
+                chunk = var[start:start + chunkSize]
+                for chunkIndex in np.ndindex(chunk.shape[:-2]):
+                    # Wait for a free slot to keep memory bounded.
+                    while not freeSlots:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    slot = freeSlots.pop()
+                    image = np.ndarray(shape, dtype=np.float32,
+                        buffer=inputSlots[slot].buf)
+                    image[...] = maskImage(chunk[chunkIndex], varMin, varMax)
+                    index = (start + chunkIndex[0],) + chunkIndex[1:]
+                    future = pool.submit(siedSlot, slot, filterSize, siedArgs)
+                    pending[future] = (slot, index)
+                del chunk
+            collect(wait(pending).done)
+    finally:
+        for block in inputSlots + outputSlots:
+            block.close()
+            block.unlink()
+        outObj.close()
+        inObj.close()
+    return numDone
+
+def siedTiled(var, outVar, index=(), filterSize=5, tileSize=1024, varMin=None,
+    varMax=None, siedArgs=(), numThreads=None):
+# Out-of-core median filter + SIED of the 2D slice var[index]. The front mask
+# is computed tile by tile and written to outVar[index], so memory is bounded
+# by the tile size. Each tile reads the SIED windows that touch it, one pixel
+# around them and the median filter radius, which makes the result identical
+# to running nanMedianFilter and sied2 on the whole slice.
+    (winSize, stride, numTry, numClass1_threshold, numClass2_threshold,
+        theta_threshold, cohesion1_threshold, cohesion2_threshold,
+        cohesionBoth_threshold) = tuple(siedArgs) + SIED_DEFAULTS[len(siedArgs):]
+    index = tuple(index)
+    (height, width) = var.shape[-2:]
+    radius = filterSize // 2
+    all_tl_ys = np.unique(windowStarts(height, winSize, stride))
+    all_tl_xs = np.unique(windowStarts(width, winSize, stride))
+
+    for tile_y0 in range(0, height, tileSize):
+        tile_y1 = min(tile_y0 + tileSize, height)
+        # Windows touching these rows
+        tl_ys = all_tl_ys[(all_tl_ys > tile_y0 - winSize) & (all_tl_ys < tile_y1)]
+        for tile_x0 in range(0, width, tileSize):
+            tile_x1 = min(tile_x0 + tileSize, width)
+            tile = index + (slice(tile_y0, tile_y1), slice(tile_x0, tile_x1))
+            tl_xs = all_tl_xs[(all_tl_xs > tile_x0 - winSize) &
+                (all_tl_xs < tile_x1)]
+            if len(tl_ys) == 0 or len(tl_xs) == 0:
+                outVar[tile] = 0
+                continue
+
+            # Part of the filtered image these windows look at ...
+            fy0 = max(tl_ys[0] - 1, 0)
+            fy1 = min(tl_ys[-1] + winSize + 1, height)
+            fx0 = max(tl_xs[0] - 1, 0)
+            fx1 = min(tl_xs[-1] + winSize + 1, width)
+            # ... and the part of the image the median filter needs for it.
+            iy0 = max(fy0 - radius, 0)
+            iy1 = min(fy1 + radius, height)
+            ix0 = max(fx0 - radius, 0)
+            ix1 = min(fx1 + radius, width)
+
+            image = maskImage(var[index + (slice(iy0, iy1), slice(ix0, ix1))],
+                varMin, varMax)
+            filtered = np.ascontiguousarray(bandedFilter(nanMedianFilter,
+                image, medianHalo(filterSize), numThreads, size=filterSize)[
+                fy0 - iy0:fy1 - iy0, fx0 - ix0:fx1 - ix0])
+            del image
+            with NumbaThreads(numThreads):
+                outVar[tile] = tileFrontsKernel(filtered, fy0, fx0, tl_ys,
+                    tl_xs, winSize, numTry, numClass1_threshold,
+                    numClass2_threshold, theta_threshold, cohesion1_threshold,
+                    cohesion2_threshold, cohesionBoth_threshold, tile_y0,
+                    tile_y1, tile_x0, tile_x1)
+
+def siedTiledFile(inFilename, varName, outFilename, filterSize=5,
+    tileSize=1024, varMin=None, varMax=None, frontName=None, siedArgs=(),
+    numThreads=None):
+# siedTiled on every 2D slice of a variable, written to a new file.
+    frontName = frontName or varName + "_front"
+    inObj = Dataset(inFilename)
+    var = inObj.variables[varName]
+    chunkSizes = [1] * (len(var.shape) - 2) + [min(tileSize, length)
+        for length in var.shape[-2:]]
+    outObj, front = createOutput(inObj, varName, outFilename, frontName,
+        chunkSizes)
+    numDone = 0
+    try:
+        for index in np.ndindex(var.shape[:-2]):
+            siedTiled(var, front, index, filterSize, tileSize, varMin, varMax,
+                siedArgs, numThreads)
+            numDone += 1
+    finally:
+        outObj.close()
+        inObj.close()
+    return numDone
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect SIED fronts on every "
+        "time step of a netCDF variable, or tile by tile with --tile.")
+    parser.add_argument("input")
+    parser.add_argument("variable")
+    parser.add_argument("output")
+    parser.add_argument("--filter-size", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--in-flight", type=int, default=None,
+        help="max slices held in shared memory at once")
+    parser.add_argument("--chunk", type=int, default=None,
+        help="time steps read from the file at once")
+    parser.add_argument("--tile", type=int, default=None,
+        help="process each slice out-of-core in tiles of this size")
+    parser.add_argument("--min", type=float, default=None,
+        help="mask values smaller than this")
+    parser.add_argument("--max", type=float, default=None,
+        help="mask values greater than this")
+    for (name, kind), default in zip((("--win-size", int), ("--stride", int),
+        ("--num-try", int), ("--class1", float), ("--class2", float),
+        ("--theta", float), ("--cohesion1", float), ("--cohesion2", float),
+        ("--cohesion-both", float)), SIED_DEFAULTS):
+        parser.add_argument(name, type=kind, default=default)
+    args = parser.parse_args()
+
+    siedArgs = (args.win_size, args.stride, args.num_try, args.class1,
+        args.class2, args.theta, args.cohesion1, args.cohesion2,
+        args.cohesion_both)
+    if args.tile:
+        numDone = siedTiledFile(args.input, args.variable, args.output,
+            args.filter_size, args.tile, args.min, args.max,
+            siedArgs=siedArgs, numThreads=args.workers)
+    else:
+        numDone = siedBatch(args.input, args.variable, args.output,
+            args.filter_size, args.workers, args.in_flight, args.chunk,
+            args.min, args.max, siedArgs=siedArgs)
+    print(str(numDone) + " slices processed.")
@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# Directory of the caches kept between sessions
+CACHE_DIR = os.environ.get("NCVIEWER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ncviewer"))
+
+def fingerprint(array):
+# Digest of an array's shape, dtype and values, used as a cache key.
+    array = np.ascontiguousarray(np.ma.getdata(array))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    digest.update(array.view(np.uint8).ravel())
+    return digest.hexdigest()
+
+def cacheFile(kind, key):
+# Path of the persistent cache file of a key (a string) under CACHE_DIR/kind.
+    directory = os.path.join(CACHE_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return os.path.join(directory, digest + ".json")
+
+def loadJSON(path):
+# Content of a JSON cache file, None if it is missing or unreadable.
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def saveJSON(path, content):
+# Write a JSON cache file atomically, so a crash never leaves half a file.
+# The cache is only an optimisation, so failing to write it is ignored.
+    try:
+        with open(path + ".tmp", "w") as file:
+            json.dump(content, file)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+class LRUCache():
+# In-memory least-recently-used cache with a memory budget in bytes.
+# The least recently used entries are evicted once the budget is exceeded.
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            value, nbytes = self.entries[key]
+        except KeyError:
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, nbytes):
+        self.pop(key)
+        # Values larger than the whole budget are not cached.
+        if nbytes > self.maxBytes:
+            return
+        self.entries[key] = (value, nbytes)
+        self.numBytes += nbytes
+        self.evict()
+
+    def pop(self, key):
+        if key in self.entries:
+            value, nbytes = self.entries.pop(key)
+            self.numBytes -= nbytes
+            return value
+        return None
+
+    def setMaxBytes(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.evict()
+
+    def evict(self):
+        while self.numBytes > self.maxBytes:
+            _, (_, oldBytes) = self.entries.popitem(last=False)
+            self.numBytes -= oldBytes
+
+    def clear(self):
+        self.entries.clear()
+        self.numBytes = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,138 @@
+import struct
+import numpy as np
+from netCDF4 import default_fillvals
+
+# dtypes of the classic format nc_type codes. Data is big-endian.
+CLASSIC_TYPES = {1: ">i1", 2: "S1", 3: ">i2", 4: ">i4", 5: ">f4", 6: ">f8",
+    7: ">u1", 8: ">u2", 9: ">u4", 10: ">i8", 11: ">u8"}
+# Header list tags
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+class HeaderReader():
+# Reads the big-endian fields of a classic header from a buffer. Counts
+# are 8 bytes in CDF-5 files, offsets 8 bytes in CDF-2 and CDF-5 files.
+    def __init__(self, buffer, version):
+        self.buffer = buffer
+        self.pos = 4
+        self.countFormat = ">q" if version == 5 else ">i"
+        self.offsetFormat = ">i" if version == 1 else ">q"
+
+    def field(self, fmt):
+        size = struct.calcsize(fmt)
+        value, = struct.unpack(fmt, bytes(self.buffer[self.pos:self.pos + size]))
+        self.pos += size
+        return value
+
+    def count(self):
+        return self.field(self.countFormat)
+
+    def name(self):
+        size = self.count()
+        name = bytes(self.buffer[self.pos:self.pos + size]).decode("utf-8")
+        self.pos += -(-size // 4) * 4
+        return name
+
+    def listLength(self, tag):
+        # Number of entries of a dimension, attribute or variable list
+        found = self.field(">i")
+        length = self.count()
+        if found not in (0, tag):
+            raise ValueError("Bad classic netCDF header.")
+        return length
+
+    def skipAttributes(self):
+        for _ in range(self.listLength(NC_ATTRIBUTE)):
+            self.name()
+            itemsize = np.dtype(CLASSIC_TYPES[self.field(">i")]).itemsize
+            size = self.count() * itemsize
+            self.pos += -(-size // 4) * 4
+
+def classicLayout(buffer):
+# Where the data of every variable of a netCDF classic file (CDF-1, CDF-2
+# or CDF-5) is, from its header: name -> (dtype, shape, offset, strides).
+# Record variables are interleaved, so their first stride is the size of a
+# whole record.
+    if bytes(buffer[:3]) != b"CDF" or buffer[3] not in (1, 2, 5):
+        raise ValueError("Not a classic netCDF file.")
+    reader = HeaderReader(buffer, buffer[3])
+    numRecords = reader.count()
+    dimLengths = []
+    for _ in range(reader.listLength(NC_DIMENSION)):
+        reader.name()
+        dimLengths.append(reader.count())
+    reader.skipAttributes()
+
+    variables = []
+    for _ in range(reader.listLength(NC_VARIABLE)):
+        name = reader.name()
+        dimIds = [reader.count() for _ in range(reader.count())]
+        reader.skipAttributes()
+        dtype = np.dtype(CLASSIC_TYPES[reader.field(">i")])
+        reader.count()
+        begin = reader.field(reader.offsetFormat)
+        isRecord = len(dimIds) > 0 and dimLengths[dimIds[0]] == 0
+        shape = [dimLengths[dimId] for dimId in dimIds]
+        variables.append((name, dtype, shape, begin, isRecord))
+
+    # A record holds the padded slab of every record variable, unpadded if
+    # there is only one.
+    slabs = [dtype.itemsize * int(np.prod(shape[1:]))
+        for name, dtype, shape, begin, isRecord in variables if isRecord]
+    recordSize = slabs[0] if len(slabs) == 1 \
+        else sum(-(-slab // 4) * 4 for slab in slabs)
+    firstRecord = min((begin for name, dtype, shape, begin, isRecord
+        in variables if isRecord), default=len(buffer))
+    if numRecords < 0 and recordSize:
+        # Streaming files leave the count for the reader to work out.
+        numRecords = (len(buffer) - firstRecord) // recordSize
+
+    layout = {}
+    for name, dtype, shape, begin, isRecord in variables:
+        strides = [dtype.itemsize] * len(shape)
+        for i in range(len(shape) - 2, -1, -1):
+            strides[i] = strides[i + 1] * shape[i + 1]
+        if isRecord:
+            shape[0] = numRecords
+            strides[0] = recordSize
+        layout[name] = (dtype, tuple(shape), begin, tuple(strides))
+    return layout
+
+def safeValue(value, dtype):
+# Attribute value cast to the variable's dtype, None if the cast loses
+# information, as netCDF4 ignores such attributes.
+    if value is None:
+        return None
+    value = np.asarray(value)
+    cast = value.astype(dtype)
+    if not np.array_equal(cast, value, equal_nan=value.dtype.kind == "f"):
+        return None
+    return cast
+
+def maskInvalid(data, attributes):
+# data as a masked array without copying it, masking what netCDF4 masks:
+# missing_value, _FillValue (or the default fill value) and values outside
+# valid_range or valid_min/valid_max.
+    dtype = data.dtype
+    mask = np.zeros(np.shape(data), dtype=bool)
+    fill = safeValue(attributes.get("_FillValue"), dtype)
+    if fill is None:
+        fill = np.array(default_fillvals[dtype.str[1:]], dtype)
+    for value in (safeValue(attributes.get("missing_value"), dtype), fill):
+        if value is None:
+            continue
+        for item in np.atleast_1d(value):
+            mask |= np.isnan(data) if dtype.kind == "f" and np.isnan(item) \
+                else data == item
+    validRange = safeValue(attributes.get("valid_range"), dtype)
+    if validRange is not None and validRange.size == 2:
+        validMin, validMax = validRange
+    else:
+        validMin = safeValue(attributes.get("valid_min"), dtype)
+        validMax = safeValue(attributes.get("valid_max"), dtype)
+    if validMin is not None:
+        mask |= data < validMin
+    if validMax is not None:
+        mask |= data > validMax
+    return np.ma.masked_array(data, mask=mask, fill_value=fill, copy=False)
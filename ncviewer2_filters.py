@@ -0,0 +1,429 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numba import njit, prange, set_num_threads
+
+# Bins of the median filter histograms, split into coarse and fine bins.
+NUM_COARSE = 64
+NUM_FINE = 64
+# Quantile bin bounds: each has a bin of its own and one for the values up
+# to the next bound, plus a bin below the first.
+NUM_BOUNDS = (NUM_COARSE * NUM_FINE - 1) // 2
+# Pixels sampled to place the bin bounds
+BOUND_SAMPLES = 2 ** 20
+# Sub-bins of a bin holding several values
+NUM_SUB = 64
+
+@njit
+def selectRank(values, n, rank):
+# rank-th smallest of values[:n] by quickselect, reordering them
+    lo = 0
+    hi = n - 1
+    while lo < hi:
+        pivot = values[(lo + hi) // 2]
+        i = lo
+        j = hi
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while values[j] > pivot:
+                j -= 1
+            if i <= j:
+                (values[i], values[j]) = (values[j], values[i])
+                i += 1
+                j -= 1
+        if rank <= j:
+            hi = j
+        elif rank >= i:
+            lo = i
+        else:
+            break
+    return values[rank]
+
+@njit
+def listColumn(q, sub, v, singleValued, y, j, size, add, head, keyCount,
+    slotNext, slotPrev, slotKey, slotValue):
+# Add (or remove) the pixels of column j, rows y to y + size - 1, in bins
+# holding several values to the window's lists of pixels per bin and
+# sub-bin. Pixel (y + i, j) has slot i * size + j % size.
+    for i in range(size):
+        slot = i * size + j % size
+        if add:
+            level = q[y + i, j]
+            if level < 0 or singleValued[level]:
+                slotKey[slot] = -1
+                continue
+            key = level * NUM_SUB + sub[y + i, j]
+            slotKey[slot] = key
+            slotValue[slot] = v[y + i, j]
+            slotPrev[slot] = -1
+            slotNext[slot] = head[key]
+            if head[key] >= 0:
+                slotPrev[head[key]] = slot
+            head[key] = slot
+            keyCount[key] += 1
+        else:
+            key = slotKey[slot]
+            if key < 0:
+                continue
+            if slotPrev[slot] >= 0:
+                slotNext[slotPrev[slot]] = slotNext[slot]
+            else:
+                head[key] = slotNext[slot]
+            if slotNext[slot] >= 0:
+                slotPrev[slotNext[slot]] = slotPrev[slot]
+            keyCount[key] -= 1
+            slotKey[slot] = -1
+
+@njit
+def medianTile(q, sub, v, out, binValue, singleValued, subValue,
+    subSingleValued, size, ty0, ty1, tx0, tx1):
+# Perreault-Hebert median filter of one tile of a padded image v, its bins q
+# and sub-bins sub. q[y:y+size, x:x+size] is the window of output pixel (y,x)
+# and q is -1 for NaN. Column histograms slide down the rows and the window's
+# coarse histogram slides along a row; the fine histogram of a coarse bin is
+# only brought up to date when the median falls in that bin. The histograms
+# find the bin of the median and its rank in the bin. A bin holding one value
+# gives the median as it is, at a cost per pixel that does not depend on
+# size. For bins holding several values the window also keeps a list of its
+# pixels per sub-bin, updated by a column in and out per pixel; the counts
+# give the sub-bin of the median, and only a sub-bin holding several values
+# is searched.
+    numLevels = NUM_COARSE * NUM_FINE
+    numCols = tx1 - tx0 + size - 1
+    colFine = np.zeros((numCols, numLevels), dtype=np.uint16)
+    colCoarse = np.zeros((numCols, NUM_COARSE), dtype=np.uint16)
+    kernelFine = np.zeros(numLevels, dtype=np.int32)
+    kernelCoarse = np.zeros(NUM_COARSE, dtype=np.int32)
+    lastStart = np.empty(NUM_COARSE, dtype=np.int64)
+    # Pixel lists per sub-bin, only needed if a bin holds several values
+    track = not np.all(singleValued)
+    numKeys = numLevels * NUM_SUB if track else 0
+    head = np.full(numKeys, -1, dtype=np.int32)
+    keyCount = np.zeros(numKeys, dtype=np.int32)
+    slotNext = np.empty(size * size, dtype=np.int32)
+    slotPrev = np.empty(size * size, dtype=np.int32)
+    slotKey = np.full(size * size, -1, dtype=np.int32)
+    slotValue = np.empty(size * size, dtype=v.dtype)
+    window = np.empty(size * size, dtype=v.dtype)
+
+    # Column histograms of the first size - 1 rows
+    for y in range(ty0, ty0 + size - 1):
+        for j in range(numCols):
+            level = q[y, tx0 + j]
+            if level >= 0:
+                colFine[j, level] += 1
+                colCoarse[j, level // NUM_FINE] += 1
+
+    for y in range(ty0, ty1):
+        # Add the window's last row to the column histograms.
+        for j in range(numCols):
+            level = q[y + size - 1, tx0 + j]
+            if level >= 0:
+                colFine[j, level] += 1
+                colCoarse[j, level // NUM_FINE] += 1
+
+        # Coarse histogram of the first size - 1 columns
+        kernelCoarse[:] = 0
+        for j in range(size - 1):
+            for c in range(NUM_COARSE):
+                kernelCoarse[c] += colCoarse[j, c]
+        lastStart[:] = -size
+        if track:
+            for j in range(size - 1):
+                listColumn(q, sub, v, singleValued, y, tx0 + j, size, True,
+                    head, keyCount, slotNext, slotPrev, slotKey, slotValue)
+
+        for x in range(tx0, tx1):
+            start = x - tx0
+            for c in range(NUM_COARSE):
+                kernelCoarse[c] += colCoarse[start + size - 1, c]
+            if track:
+                listColumn(q, sub, v, singleValued, y, x + size - 1, size,
+                    True, head, keyCount, slotNext, slotPrev, slotKey, slotValue)
+
+            # Keep NaN where the centre pixel is invalid.
+            if q[y + size // 2, x + size // 2] < 0:
+                out[y, x] = np.nan
+            else:
+                # Coarse bin holding the median of the valid pixels
+                count = 0
+                for c in range(NUM_COARSE):
+                    count += kernelCoarse[c]
+                rank = count // 2
+                c = 0
+                while rank >= kernelCoarse[c]:
+                    rank -= kernelCoarse[c]
+                    c += 1
+
+                # Bring the fine histogram of this coarse bin up to date.
+                f0 = c * NUM_FINE
+                if start - lastStart[c] >= size:
+                    kernelFine[f0:f0 + NUM_FINE] = 0
+                    for j in range(start, start + size):
+                        for f in range(f0, f0 + NUM_FINE):
+                            kernelFine[f] += colFine[j, f]
+                else:
+                    for j in range(lastStart[c], start):
+                        for f in range(f0, f0 + NUM_FINE):
+                            kernelFine[f] += colFine[j + size, f] - colFine[j, f]
+                lastStart[c] = start
+
+                # Fine bin holding the median
+                f = f0
+                while rank >= kernelFine[f]:
+                    rank -= kernelFine[f]
+                    f += 1
+
+                if singleValued[f]:
+                    out[y, x] = binValue[f]
+                else:
+                    # Sub-bin holding the median
+                    key = f * NUM_SUB
+                    while rank >= keyCount[key]:
+                        rank -= keyCount[key]
+                        key += 1
+                    if subSingleValued[key]:
+                        out[y, x] = subValue[key]
+                    else:
+                        # The rank-th smallest value of the sub-bin's pixels
+                        n = 0
+                        slot = head[key]
+                        while slot >= 0:
+                            window[n] = slotValue[slot]
+                            n += 1
+                            slot = slotNext[slot]
+                        out[y, x] = selectRank(window, n, rank)
+
+            for c in range(NUM_COARSE):
+                kernelCoarse[c] -= colCoarse[start, c]
+            if track:
+                listColumn(q, sub, v, singleValued, y, x, size, False,
+                    head, keyCount, slotNext, slotPrev, slotKey, slotValue)
+
+        # Empty the pixel lists for the next row.
+        if track:
+            for j in range(tx1, tx0 + numCols):
+                listColumn(q, sub, v, singleValued, y, j, size, False,
+                    head, keyCount, slotNext, slotPrev, slotKey, slotValue)
+
+        # Remove the window's first row from the column histograms.
+        for j in range(numCols):
+            level = q[y, tx0 + j]
+            if level >= 0:
+                colFine[j, level] -= 1
+                colCoarse[j, level // NUM_FINE] -= 1
+
+@njit(parallel=True)
+def binKernel(image, bounds, paired, q):
+# Bin of every pixel, -1 for NaN, and 0 below bounds[0]. Paired, bin 2k+1
+# holds the pixels equal to bounds[k] and bin 2k+2 those between bounds[k]
+# and bounds[k+1], so a value many pixels share has a bin of its own; else
+# bin k+1 holds those from bounds[k] up to bounds[k+1].
+    (height, width) = image.shape
+    for y in prange(height):
+        for x in range(width):
+            value = image[y, x]
+            if np.isnan(value):
+                q[y, x] = -1
+                continue
+            k = np.searchsorted(bounds, value, side="right") - 1
+            if not paired:
+                q[y, x] = k + 1
+            elif k >= 0 and bounds[k] == value:
+                q[y, x] = 2 * k + 1
+            else:
+                q[y, x] = 2 * k + 2
+
+@njit
+def binRanges(image, q, low, high):
+# Smallest and largest value in every bin
+    (height, width) = image.shape
+    for y in range(height):
+        for x in range(width):
+            level = q[y, x]
+            if level >= 0:
+                low[level] = min(low[level], image[y, x])
+                high[level] = max(high[level], image[y, x])
+
+@njit(parallel=True)
+def subBinKernel(image, q, low, high, sub):
+# Sub-bin of every pixel: 0 in a bin holding one value, else where the value
+# falls between the bin's smallest and largest, in NUM_SUB steps.
+    (height, width) = image.shape
+    for y in prange(height):
+        for x in range(width):
+            level = q[y, x]
+            if level < 0 or low[level] == high[level]:
+                sub[y, x] = 0
+            else:
+                sub[y, x] = min(int((image[y, x] - low[level])
+                    / (high[level] - low[level]) * NUM_SUB), NUM_SUB - 1)
+
+@njit
+def subBinRanges(image, q, sub, low, high):
+# Smallest and largest value in every sub-bin, indexed by
+# bin * NUM_SUB + sub-bin
+    (height, width) = image.shape
+    for y in range(height):
+        for x in range(width):
+            level = q[y, x]
+            if level >= 0:
+                key = level * NUM_SUB + sub[y, x]
+                low[key] = min(low[key], image[y, x])
+                high[key] = max(high[key], image[y, x])
+
+@njit(parallel=True)
+def medianKernel(q, sub, v, out, binValue, singleValued, subValue,
+    subSingleValued, size, tileHeight, tileWidth):
+# medianTile over every tile of the image, spread over threads.
+    (height, width) = out.shape
+    numTileRows = -(-height // tileHeight)
+    numTileCols = -(-width // tileWidth)
+    for k in prange(numTileRows * numTileCols):
+        ty0 = (k // numTileCols) * tileHeight
+        tx0 = (k % numTileCols) * tileWidth
+        medianTile(q, sub, v, out, binValue, singleValued, subValue,
+            subSingleValued, size, ty0, min(ty0 + tileHeight, height), tx0,
+            min(tx0 + tileWidth, width))
+
+def nanMedianFilter(image, size, tileHeight=128, tileWidth=512):
+# NaN-aware median filter, a drop-in for scipy's median_filter(image, size)
+# on 2D images, with the same result on images without NaN. NaN pixels are
+# ignored in the windows and stay NaN in the output. Borders are reflected
+# like scipy's default mode. The bin bounds are the distinct values of a
+# sample of the image, or its quantiles if there are too many, so outliers
+# don't crowd the other values into a few bins and repeated values (fill,
+# plateaus, quantized data) have bins of their own. The result is exact
+# whatever the bins; a median in a bin holding one value costs the same
+# whatever the size.
+    image = np.asarray(image)
+    if size <= 1:
+        return image.copy()
+    if size > 255:
+        raise ValueError("Median filter size must be smaller than 256.")
+    dtype = image.dtype if image.dtype.kind == "f" else np.float64
+    values = np.ascontiguousarray(image, dtype=dtype)
+    sample = values.ravel()[::max(values.size // BOUND_SAMPLES, 1)]
+    sample = sample[~np.isnan(sample)]
+    if sample.size == 0:
+        sample = values[~np.isnan(values)]
+        if sample.size == 0:
+            return values.copy()
+    bounds = np.unique(sample)
+    paired = len(bounds) >= NUM_COARSE * NUM_FINE
+    if paired:
+        sample = np.sort(sample)
+        bounds = np.unique(sample[np.arange(NUM_BOUNDS) * len(sample)
+            // NUM_BOUNDS])
+
+    # Bin, find the bins and sub-bins holding a single value, and pad.
+    # Window of output pixel (y,x) starts at q[y,x].
+    numLevels = NUM_COARSE * NUM_FINE
+    q = np.empty(values.shape, dtype=np.int16)
+    binKernel(values, bounds, paired, q)
+    low = np.full(numLevels, np.inf, dtype=dtype)
+    high = np.full(numLevels, -np.inf, dtype=dtype)
+    binRanges(values, q, low, high)
+    sub = np.empty(values.shape, dtype=np.uint8)
+    subBinKernel(values, q, low, high, sub)
+    subLow = np.full(numLevels * NUM_SUB, np.inf, dtype=dtype)
+    subHigh = np.full(numLevels * NUM_SUB, -np.inf, dtype=dtype)
+    # Empty bins count as holding one value; low > high there.
+    singleValued = low >= high
+    if not singleValued.all():
+        subBinRanges(values, q, sub, subLow, subHigh)
+    padding = ((size // 2, (size - 1) // 2),) * 2
+    q = np.pad(q, padding, mode="symmetric")
+    sub = np.pad(sub, padding, mode="symmetric")
+    v = np.pad(values, padding, mode="symmetric")
+
+    out = np.empty(image.shape, dtype=dtype)
+    medianKernel(q, sub, v, out, low, singleValued, subLow, subLow >= subHigh,
+        size, tileHeight, tileWidth)
+    return out
+
+@njit(parallel=True)
+def sobelKernel(image, magnitude, direction, withDirection):
+# Sobel gradient magnitude (and direction) in one sweep over the image.
+# Borders are reflected like scipy's sobel. As with scipy, a NaN anywhere in
+# the 3x3 neighbourhood gives NaN (the centre joins through 0 * centre).
+    (height, width) = image.shape
+    for y in prange(height):
+        rowM = image[max(y - 1, 0)]
+        row0 = image[y]
+        rowP = image[min(y + 1, height - 1)]
+        out = magnitude[y]
+        for x in range(width):
+            xm = max(x - 1, 0)
+            xp = min(x + 1, width - 1)
+            # Same as sobel(image, axis=0) and sobel(image, axis=1)
+            gy = ((rowP[xm] + 2 * rowP[x] + rowP[xp])
+                - (rowM[xm] + 2 * rowM[x] + rowM[xp]))
+            gx = ((rowM[xp] + 2 * row0[xp] + rowP[xp])
+                - (rowM[xm] + 2 * row0[xm] + rowP[xm]))
+            out[x] = np.sqrt(gx * gx + gy * gy) + 0 * row0[x]
+            if withDirection:
+                direction[y, x] = np.arctan2(gy, gx) + 0 * row0[x]
+
+def sobelGradient(image, out=None, direction=None):
+# Fused replacement for np.sqrt(sobel(image, axis=0)**2 + sobel(image, axis=1)**2).
+# The magnitude is written into out when it has the image's shape and a
+# float dtype, so a buffer can be reused between calls; otherwise a new
+# array of the image's float dtype is made. If direction is an array, the
+# gradient direction (radians, arctan2(d/drow, d/dcol)) is written into it.
+    image = np.asarray(image)
+    dtype = image.dtype if image.dtype.kind == "f" else np.float64
+    if out is None or out.shape != image.shape or out.dtype.kind != "f":
+        out = np.empty(image.shape, dtype=dtype)
+    withDirection = direction is not None
+    if not withDirection:
+        direction = np.empty((0, 0), dtype=out.dtype)
+    sobelKernel(image, out, direction, withDirection)
+    return out
+
+def medianHalo(size):
+# Rows above and below a pixel that a median filter of this size looks at.
+    return (size // 2, (size - 1) // 2)
+
+# Rows above and below a pixel that the Sobel gradient looks at
+SOBEL_HALO = (1, 1)
+
+def bandedFilter(func, image, halo, numWorkers=None, output=None,
+    bandHeight=None, check=False, **kwargs):
+# Run a filter func(image, **kwargs), like nanMedianFilter, sobelGradient or
+# a scipy.ndimage one, on row bands of a 2D image in a thread pool. Each band
+# is read with halo = (rows above, rows below) extra rows and only its own
+# rows are written to output (a new array unless output has the image's
+# shape), so the result is identical to func(image, **kwargs). Bands touching the image edge are not padded, so
+# the filter's own border mode still applies there. Compiled kernels run one
+# thread per band, so numWorkers (default all cores) sets how many cores are
+# used. check also runs the unsplit call and raises if a pixel differs.
+    image = np.asarray(image)
+    (height, width) = image.shape
+    if isinstance(halo, int):
+        halo = (halo, halo)
+    numWorkers = numWorkers or os.cpu_count() or 1
+    if output is None or output.shape != image.shape:
+        output = np.empty(image.shape, dtype=image.dtype)
+    if numWorkers == 1 or height < 2 * (halo[0] + halo[1] + 1):
+        output[...] = func(image, **kwargs)
+        return output
+    bandHeight = bandHeight or max(-(-height // (4 * numWorkers)),
+        halo[0] + halo[1] + 1)
+
+    def runBand(y0):
+        set_num_threads(1)
+        y1 = min(y0 + bandHeight, height)
+        r0 = max(y0 - halo[0], 0)
+        r1 = min(y1 + halo[1], height)
+        output[y0:y1] = func(image[r0:r1], **kwargs)[y0 - r0:y1 - r0]
+
+    with ThreadPoolExecutor(numWorkers) as pool:
+        # list() re-raises any exception from the bands.
+        list(pool.map(runBand, range(0, height, bandHeight)))
+    if check and not np.array_equal(output, func(image, **kwargs),
+        equal_nan=output.dtype.kind in "fc"):
+        raise RuntimeError("Banded " + func.__name__
+            + " differs from the unsplit call; is the halo too small?")
+    return output
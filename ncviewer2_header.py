@@ -0,0 +1,165 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from netCDF4 import Dataset
+
+from ncviewer2_cache import cacheFile, loadJSON, saveJSON
+from ncviewer2_classic import classicLayout, maskInvalid
+
+# Changing what readHeader saves must change this, so old headers are read
+# again.
+HEADER_VERSION = 2
+
+def encodeValue(value):
+# JSON form of an attribute value, keeping numpy types so values print the
+# same as when read from the file.
+    if isinstance(value, str):
+        return value
+    array = np.asarray(value)
+    if array.dtype.kind not in "biuf":
+        return str(value)
+    return {"dtype": array.dtype.str, "shape": array.shape,
+        "value": array.tolist()}
+
+def decodeValue(value):
+    if isinstance(value, str):
+        return value
+    array = np.array(value["value"], dtype=value["dtype"]).reshape(
+        value["shape"])
+    return array[()] if array.ndim == 0 else array
+
+def readHeader(obj):
+# Everything the tree, the attribute panel and the dialogs need from a file:
+# global attributes, dimensions, and per variable its dimensions, shape,
+# dtype, chunking, filters, attributes and printed form.
+    variables = OrderedDict()
+    for name, var in obj.variables.items():
+        dtype = var.dtype.str if isinstance(var.dtype, np.dtype) else None
+        variables[name] = {"dimensions": var.dimensions, "shape": var.shape,
+            "dtype": dtype, "chunking": var.chunking(),
+            "filters": var.filters(), "text": str(var),
+            "attributes": [(attrName, encodeValue(var.getncattr(attrName)))
+                for attrName in var.ncattrs()]}
+    return {"version": HEADER_VERSION, "format": obj.data_model,
+        "attributes": [(name, encodeValue(obj.getncattr(name)))
+            for name in obj.ncattrs()],
+        "dimensions": [(name, len(dim)) for name, dim in obj.dimensions.items()],
+        "variables": variables}
+
+class CachedDataset():
+# netCDF file whose header is served from a copy under CACHE_DIR, keyed by
+# path, size and mtime. Opening an unchanged file again doesn't read its
+# header; the file itself is only opened when data is read. Uncompressed
+# classic (netCDF3) files are memory-mapped instead.
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.handle = None
+        self.mapping = None
+        stat = os.stat(self.path)
+        cachePath = cacheFile("header", self.path)
+        header = loadJSON(cachePath)
+        if header is None or header.get("version") != HEADER_VERSION \
+            or header["size"] != stat.st_size or header["mtime"] != stat.st_mtime:
+            header = readHeader(self.dataset())
+            header["size"] = stat.st_size
+            header["mtime"] = stat.st_mtime
+            saveJSON(cachePath, header)
+        self.attributes = OrderedDict((name, decodeValue(value))
+            for name, value in header["attributes"])
+        self.dimensions = OrderedDict(header["dimensions"])
+        self.isClassic = header["format"].startswith("NETCDF3")
+        self.variables = OrderedDict((name, CachedVariable(self, name, entry))
+            for name, entry in header["variables"].items())
+
+    def dataset(self):
+        # The netCDF4 Dataset, opened on first use
+        if self.handle is None:
+            self.handle = Dataset(self.path)
+        return self.handle
+
+    def mappedArray(self, name):
+        # A classic file variable's data as an array backed by the mapped
+        # file, so reading a region copies nothing.
+        if self.mapping is None:
+            buffer = np.memmap(self.path, dtype=np.uint8, mode="r")
+            self.mapping = (buffer, classicLayout(buffer))
+        buffer, layout = self.mapping
+        dtype, shape, offset, strides = layout[name]
+        return np.ndarray(shape, dtype, buffer=buffer, offset=offset,
+            strides=strides)
+
+    def ncattrs(self):
+        return list(self.attributes)
+
+    def getncattr(self, name):
+        return self.attributes[name]
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        self.mapping = None
+
+class CachedVariable():
+# Variable of a CachedDataset. Metadata comes from the cached header; reads
+# and anything else go to the netCDF4 variable.
+    def __init__(self, dataset, name, entry):
+        self.dataset = dataset
+        self.name = name
+        self.dimensions = tuple(entry["dimensions"])
+        self.shape = tuple(entry["shape"])
+        self.ndim = len(self.shape)
+        self.entry = entry
+        # Attribute values are decoded when asked for.
+        self.attributes = OrderedDict(entry["attributes"])
+        # Numbers of classic files that netCDF4 doesn't scale are read as
+        # views of the mapped file.
+        self.zeroCopy = dataset.isClassic and entry["dtype"] is not None \
+            and np.dtype(entry["dtype"]).kind in "iuf" and not any(
+            name in self.attributes
+            for name in ("scale_factor", "add_offset", "_Unsigned"))
+
+    def variable(self):
+        return self.dataset.dataset().variables[self.name]
+
+    @property
+    def dtype(self):
+        if self.entry["dtype"] is None:
+            return self.variable().dtype
+        return np.dtype(self.entry["dtype"])
+
+    def ncattrs(self):
+        return list(self.attributes)
+
+    def getncattr(self, name):
+        return decodeValue(self.attributes[name])
+
+    def chunking(self):
+        return self.entry["chunking"]
+
+    def filters(self):
+        return self.entry["filters"]
+
+    def __getattr__(self, name):
+        # netCDF attributes, like var.units, then netCDF4 variable methods
+        if name.startswith("__") or name in ("dataset", "name", "attributes",
+            "entry", "zeroCopy"):
+            raise AttributeError(name)
+        if name in self.attributes:
+            return self.getncattr(name)
+        return getattr(self.variable(), name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __str__(self):
+        return self.entry["text"]
+
+    def __getitem__(self, key):
+        if self.zeroCopy:
+            # Masked like netCDF4 does, on the region only.
+            return maskInvalid(self.dataset.mappedArray(self.name)[key],
+                {name: self.getncattr(name) for name in ("_FillValue",
+                "missing_value", "valid_range", "valid_min", "valid_max")
+                if name in self.attributes})
+        return self.variable()[key]
@@ -0,0 +1,287 @@
+import re
+import numpy as np
+import cftime
+
+# Upper bound of the bytes read from a variable at once by blocked reads
+# and the streaming reductions.
+READ_BYTES = 64 * 1024 ** 2
+# Upper bound of the chunk cache set on a variable before a read.
+CHUNK_CACHE_BYTES = 256 * 1024 ** 2
+
+def parseSubset(text, shape):
+# Region (a tuple of slices) of a variable of the given shape from subset
+# text: either "start, end" index pairs for every dimension, or one numpy
+# style entry per dimension, like "0, 10:-10, ::4" (an index, or
+# start:stop:step with any part left out). Indexes may be negative.
+    entries = [entry.strip() for entry in text.split(",")]
+    if not any(":" in entry for entry in entries):
+        if len(entries) != 2 * len(shape):
+            raise ValueError("Need a start and an end for each of the "
+                + str(len(shape)) + " dimensions.")
+        return tuple(slice(int(entries[i]), int(entries[i + 1]))
+            for i in range(0, len(entries), 2))
+    if len(entries) != len(shape):
+        raise ValueError("Need an index or start:stop:step for each of the "
+            + str(len(shape)) + " dimensions.")
+    region = []
+    for entry in entries:
+        fields = entry.split(":")
+        if len(fields) == 1:
+            # A single index keeps its dimension, with length 1.
+            index = int(entry)
+            region.append(slice(index, index + 1 if index != -1 else None))
+        elif len(fields) <= 3:
+            region.append(slice(*[int(field) if field.strip() else None
+                for field in fields]))
+        else:
+            raise ValueError("Bad subset entry: " + entry)
+    return tuple(region)
+
+def regionShape(shape, region):
+# Shape of var[region] for a variable of the given shape
+    return [len(range(*slice_.indices(length)))
+        for slice_, length in zip(region, shape)]
+
+def regionBounds(shape, region):
+# (start, stop, step) per dimension covering the same elements as region,
+# in increasing order: negative steps are turned around and stop is one
+# past the last element.
+    bounds = []
+    for slice_, length in zip(region, shape):
+        points = range(*slice_.indices(length))
+        if len(points) == 0:
+            bounds.append((0, 0, 1))
+            continue
+        if points.step < 0:
+            points = points[::-1]
+        bounds.append((points[0], points[-1] + 1, points.step))
+    return bounds
+
+def blockShape(var, bounds, maxBytes=READ_BYTES):
+# Chunk shape of var and shape of the blocks a region of it is read in:
+# whole chunks, grown from the last dimension while the points a block
+# reads stay under maxBytes. Contiguous variables have single element
+# chunks here, so their blocks are whole rows.
+    chunks = var.chunking()
+    if not isinstance(chunks, (list, tuple)):
+        chunks = [1] * len(bounds)
+    itemsize = getattr(var.dtype, "itemsize", 8) or 8
+    block = list(chunks)
+    for dim in reversed(range(len(bounds))):
+        (start, stop, step) = bounds[dim]
+        chunk = chunks[dim]
+        # Chunk-aligned extent of the region along this dimension
+        span = -(-stop // chunk) * chunk - start // chunk * chunk
+        # Points read along the other dimensions
+        others = 1
+        for k in range(len(bounds)):
+            if k != dim:
+                others *= -(-block[k] // bounds[k][2])
+        numPoints = maxBytes // (others * itemsize)
+        block[dim] = max(min(numPoints * step // chunk * chunk, span), chunk)
+        # Outer dimensions can only grow once this one is covered.
+        if block[dim] < span:
+            break
+    return chunks, block
+
+def regionBlocks(var, region, maxBytes=READ_BYTES):
+# Split region (a tuple of slices of var) into chunk-aligned blocks of at
+# most about maxBytes. Returns the number of blocks and a generator of
+# their slices, all with positive steps (see regionBounds).
+    bounds = regionBounds(var.shape, region)
+    chunks, block = blockShape(var, bounds, maxBytes)
+    edges = []
+    for (start, stop, step), chunk, size in zip(bounds, chunks, block):
+        if stop <= start:
+            return 0, iter(())
+        # Blocks start at the chunk boundary before the region. Blocks a
+        # large step jumps over are left out.
+        dimEdges = []
+        for low in range(start // chunk * chunk, stop, size):
+            first = start + -(-max(low - start, 0) // step) * step
+            last = min(low + size, stop)
+            if first < last:
+                dimEdges.append(slice(first, last, step))
+        edges.append(dimEdges)
+    numBlocks = int(np.prod([len(dimEdges) for dimEdges in edges]))
+    return numBlocks, (tuple(edges[dim][i] for dim, i in enumerate(index))
+        for index in np.ndindex(*[len(dimEdges) for dimEdges in edges]))
+
+def chunkLayout(var, region):
+# Chunk shape of var, its compression filters and what a read of region
+# costs: the number of chunks it touches, the bytes requested and the bytes
+# the library has to decompress, whole chunks included.
+    bounds = regionBounds(var.shape, region)
+    chunks = var.chunking()
+    itemsize = getattr(var.dtype, "itemsize", 8) or 8
+    requested = int(np.prod(regionShape(var.shape, region))) * itemsize
+    if not isinstance(chunks, (list, tuple)):
+        return {"chunks": None, "filters": None, "numChunks": 0,
+            "chunkBytes": 0, "requestedBytes": requested,
+            "decompressBytes": requested}
+    numChunks = 1
+    for (start, stop, step), chunk in zip(bounds, chunks):
+        # Chunks holding at least one point
+        numChunks *= len(np.unique(np.arange(start, stop, step) // chunk))
+    chunkBytes = int(np.prod(chunks)) * itemsize
+    filters = var.filters() or {}
+    return {"chunks": tuple(chunks),
+        "filters": [name for name, value in filters.items()
+            if value and name not in ("complevel", "shuffle", "fletcher32")],
+        "numChunks": numChunks, "chunkBytes": chunkBytes,
+        "requestedBytes": requested,
+        "decompressBytes": numChunks * chunkBytes}
+
+def byteText(numBytes):
+# Human readable size
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if numBytes < 1024 or unit == "GiB":
+            return str(round(numBytes, 1)) + " " + unit
+        numBytes /= 1024
+
+def layoutText(var):
+# Short description of how a variable is stored, e.g. for dialogs.
+    chunks = var.chunking()
+    if not isinstance(chunks, (list, tuple)):
+        return "contiguous"
+    filters = var.filters() or {}
+    text = "chunks " + str(tuple(chunks))
+    if filters.get("zlib"):
+        text += ", deflate level " + str(filters.get("complevel"))
+    for name in ("szip", "zstd", "bzip2", "blosc"):
+        if filters.get(name):
+            text += ", " + name
+    return text
+
+def readText(var, region):
+# What a read of region costs, shown before it starts.
+    layout = chunkLayout(var, region)
+    if layout["chunks"] is None:
+        return byteText(layout["requestedBytes"]) + " from a contiguous variable"
+    return (str(layout["numChunks"]) + " chunks of " + str(layout["chunks"])
+        + ", " + byteText(layout["decompressBytes"]) + " to decompress for "
+        + byteText(layout["requestedBytes"]) + " requested")
+
+def tuneChunkCache(var, region, maxBytes=CHUNK_CACHE_BYTES):
+# Make the variable's chunk cache big enough for the chunks region touches,
+# up to maxBytes, so reading neighbouring regions again (the next time
+# step of a time-chunked variable, say) doesn't decompress them again.
+    layout = chunkLayout(var, region)
+    if layout["chunks"] is None:
+        return
+    size, nelems, preemption = var.get_var_chunk_cache()
+    wanted = min(layout["decompressBytes"], maxBytes)
+    if wanted > size:
+        # HDF5 wants many more hash slots than cached chunks.
+        numSlots = max(nelems, 10 * (wanted // max(layout["chunkBytes"], 1)) + 1)
+        var.set_var_chunk_cache(wanted, numSlots, preemption)
+
+def readRegion(var, region, progress=None, maxBytes=READ_BYTES):
+# var[region] read in chunk-aligned blocks, so no chunk is decompressed
+# twice and progress(blocksDone, numBlocks) can be reported (and the read
+# cancelled by raising from it). Steps go to the netCDF library with each
+# block, so a strided read only reads the points it needs. Memory-mapped
+# variables return a view of the file instead, read as it is used.
+    if getattr(var, "zeroCopy", False):
+        return var[region]
+    tuneChunkCache(var, region)
+    numBlocks, blocks = regionBlocks(var, region, maxBytes)
+    if numBlocks <= 1:
+        return var[region]
+    bounds = regionBounds(var.shape, region)
+    for numDone, block in enumerate(blocks):
+        data = var[block]
+        if numDone == 0:
+            shape = regionShape(var.shape, region)
+            out = np.ma.empty(shape, dtype=data.dtype)
+            out.mask = np.zeros(shape, dtype=bool)
+        out[tuple(slice((s.start - start) // step, (s.start - start) // step + n)
+            for s, (start, stop, step), n
+            in zip(block, bounds, data.shape))] = data
+        if progress:
+            progress(numDone + 1, numBlocks)
+    # Blocks were read in increasing order; turn negative steps around.
+    return out[tuple(slice(None, None, -1 if slice_.indices(length)[2] < 0
+        else 1) for slice_, length in zip(region, var.shape))]
+
+class CoordinateIndex():
+# Binary search over a monotonic 1D coordinate variable, read once. Values
+# are numbers or, for time coordinates ("<units> since <date>"), dates like
+# 2000-01-31 or 2000-01-31T12:00.
+    def __init__(self, var):
+        self.values = np.ma.filled(np.ma.asarray(var[:], dtype=np.float64),
+            np.nan)
+        self.units = getattr(var, "units", "")
+        self.calendar = getattr(var, "calendar", "standard")
+        steps = np.diff(self.values)
+        self.descending = len(steps) > 0 and steps[0] < 0
+        if not (np.all(steps < 0) if self.descending else np.all(steps > 0)):
+            raise ValueError(var.name + " is not monotonic.")
+
+    def toNumber(self, text):
+        try:
+            return float(text)
+        except ValueError:
+            if " since " not in self.units:
+                raise
+        fields = [int(field) for field in re.split(r"[-T:/ ]+", text.strip())]
+        date = cftime.datetime(*fields, calendar=self.calendar)
+        return cftime.date2num(date, self.units, self.calendar)
+
+    def sorted(self):
+        # Values in increasing order and a map back to indexes
+        if self.descending:
+            return self.values[::-1], lambda i: len(self.values) - i
+        return self.values, lambda i: i
+
+    def rangeSlice(self, low, high):
+        # Indexes of the values in [low, high], either order
+        (low, high) = sorted((low, high))
+        values, toIndex = self.sorted()
+        start = np.searchsorted(values, low, "left")
+        stop = np.searchsorted(values, high, "right")
+        if self.descending:
+            (start, stop) = (toIndex(stop), toIndex(start))
+        return slice(int(start), int(stop))
+
+    def nearestSlice(self, value):
+        # Index of the value closest to value
+        values, toIndex = self.sorted()
+        i = int(np.clip(np.searchsorted(values, value), 1, len(values) - 1)) \
+            if len(values) > 1 else 0
+        if i > 0 and abs(values[i - 1] - value) <= abs(values[i] - value):
+            i -= 1
+        i = toIndex(i) - 1 if self.descending else i
+        return slice(i, i + 1)
+
+def coordinateRegion(var, text, coordinateIndex, dimNames=()):
+# Region of var selected by coordinate values, e.g.
+# "time=2000-01-01..2000-01-31, lat=-10..10..2, lon=120". A range keeps the
+# values inside it (every step-th one if a step follows), a single value
+# the nearest one, and dimensions not named are kept whole.
+# coordinateIndex(dimName) gives the CoordinateIndex of a dimension. Names
+# in dimNames but not in var's dimensions are skipped, so one selection
+# applies to a field and to its lon/lat variables.
+    region = [slice(None)] * len(var.dimensions)
+    for entry in text.split(","):
+        if not entry.strip():
+            continue
+        name, _, values = entry.partition("=")
+        name = name.strip()
+        if name not in var.dimensions:
+            if name in dimNames:
+                continue
+            raise ValueError(name + " is not a dimension of " + var.name + ".")
+        index = coordinateIndex(name)
+        values = values.split("..")
+        if len(values) == 1:
+            region[var.dimensions.index(name)] = index.nearestSlice(
+                index.toNumber(values[0]))
+        else:
+            slice_ = index.rangeSlice(index.toNumber(values[0]),
+                index.toNumber(values[1]))
+            # Optional index step, e.g. lat=-10..10..4
+            step = int(values[2]) if len(values) > 2 else None
+            region[var.dimensions.index(name)] = slice(slice_.start,
+                slice_.stop, step)
+    return tuple(region)
@@ -3,141 +3,112 @@ from PyQt5 import QtWidgets, QtCore
 from netCDF4 import Dataset
 import cftime
 import numpy as np
-from numba import njit
-from scipy.ndimage.filters import sobel, median_filter
 from matplotlib.image import imsave
+from numba import config
 
 from ncviewer2_ui import *
+from ncviewer2_sied import *
+from ncviewer2_filters import *
+from ncviewer2_cache import *
+from ncviewer2_tree import *
+from ncviewer2_io import *
+from ncviewer2_stats import *
+from ncviewer2_aggregate import *
+from ncviewer2_render import *
 
-@njit
-def sied2(sst, winSize=16, stride=8, numTry=64, numClass1_threshold=0.3,
-    numClass2_threshold=0.3, theta_threshold=0.7, cohesion1_threshold=0.87,
-    cohesion2_threshold=0.87, cohesionBoth_threshold=0.89):
-# SIED Cayula-Cornillon algorithm for detecting fronts in SST images.
-# The original contour-following algorithm is not included.
-    (height,width) = sst.shape
-    front = np.zeros((height,width))
-    for row in range(0,height-1,stride):
-        for col in range(0,width-1,stride):
-        # Defind window. tf = topleft, bf = bottomright.
-        # We dont collect pixels on the image's edge.
-            tl_y = row + 1
-            tl_x = col + 1
-            br_y = row + winSize
-            br_x = col + winSize
-            if br_y >= height - 1:
-                br_y = height - 2
-                tl_y = br_y - winSize + 1
-            if br_x >= width - 1:
-                br_x = width - 2
-                tl_x = br_x - winSize + 1
-        
-            # This window's data and info
-            data = sst[tl_y:br_y+1,tl_x:br_x+1].flatten()
-            winMin = np.nanmin(data)
-            winMax = np.nanmax(data)
-            # Get possable segmenting thresholds.
-            pst = np.linspace(winMin,winMax,numTry)
-            # Histogram analysis
-            theta = np.zeros(numTry)
-            numClass1 = np.zeros(numTry)
-            numClass2 = np.zeros(numTry)
-            for i in range(len(pst)):
-                # Class flag
-                cf1 = data < pst[i]
-                cf2 = data >= pst[i]
-                # Number of pixels of cold watermass (class1) and
-                # warm one (class2)
-                numClass1[i] = np.nansum(cf1)
-                numClass2[i] = np.nansum(cf2)
-                # Check if we have enough data points.
-                if (numClass1[i] < winSize ** 2 * numClass1_threshold or
-                    numClass2[i] < winSize ** 2 * numClass2_threshold or
-                    np.isnan(numClass1[i]) or
-                    np.isnan(numClass2[i])):
-                    continue
-                # mean sst of class1 and class2
-                meanTemp1 = np.nanmean(data[cf1])
-                meanTemp2 = np.nanmean(data[cf2])
-                # sst variance of class1 and class2
-                variance1 = np.nanvar(data[cf1])
-                variance2 = np.nanvar(data[cf2])
-                # within-cluster variance (wcv)
-                wcv = (numClass1[i] / (numClass1[i] + numClass2[i]) * variance1
-                    + numClass2[i] / (numClass1[i] + numClass2[i]) * variance2)
-            
-                # between-cluster variance (bcv)
-                bcv = (numClass1[i] * numClass2[i] / (numClass1[i] + numClass2[i])
-                    * (meanTemp1 - meanTemp2) ** 2)
-            
-                # the ratio, denoted theta, used to decide whether one or two
-                # populations are present
-                theta[i] = bcv / (wcv + bcv)
-            # Find max theta and its index.
-            theta_idx = 0
-            thetaMax = 0
-            for currentTheta in theta:
-                if currentTheta > thetaMax:
-                    thetaMax = currentTheta
-                    index = theta_idx
-                theta_idx += 1
-        
-            # Now lets determine if this window pass the histogram analysis.
-            if thetaMax >= theta_threshold:
-                pst_opt = pst[index]
-                numC1 = numClass1[index]
-                numC2 = numClass2[index]
-            else:
-                continue
-            # Cohesion test
-            # r1: total number of comparisons between center pixels and neighbors
-            # that both belong to population 1.
-            r1 = 0
-            # r2 is similarly defined.
-            r2 = 0
-            # Check only one neighbor (top)
-            for y in range(tl_y,br_y+1):
-                for x in range(tl_x,br_x+1):
-                    # Count r1.
-                    if sst[y,x] < pst_opt and sst[y-1,x] < pst_opt:
-                        r1 += 1
-                    # Count r2.
-                    if sst[y,x] >= pst_opt and sst[y-1,x] >= pst_opt:
-                        r2 += 1
-        
-            # Lets decide if the window pass the cohesion test.
-            if (r1 / numC1 < cohesion1_threshold or
-                r2 / numC2 < cohesion2_threshold or
-                (r1 + r2) / (numC1 + numC2) < cohesionBoth_threshold):
-                continue
-            # Location of edge pixels
-            # Mark pixels on warm side of the front, not two sides, as was
-            # described in the paper.
-            for y in range(tl_y,br_y+1):
-                for x in range(tl_x,br_x+1):
-                    if (sst[y,x] >= pst_opt and (
-                        sst[y-1,x] < pst_opt or
-                        sst[y+1,x] < pst_opt or
-                        sst[y,x-1] < pst_opt or
-                        sst[y,x+1] < pst_opt)):
-                        front[y,x] = 1
-
-    return front
+# Memory budget of the SIED result cache.
+SIED_CACHE_BYTES = 1024 ** 3
+# Memory budget of the filtered image cache.
+FILTER_CACHE_BYTES = 1024 ** 3
+# Threads the median filter and the gradient run on, None for all cores.
+# The SIED view uses the dashboard's thread count instead.
+FILTER_WORKERS = None
+
+# Compiled kernels run on a worker thread, which numba's tbb threading layer
+# doesn't shut down cleanly from, so the app hangs on exit. Prefer OpenMP.
+config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+
+class JobCancelled(Exception):
+    pass
+
+class Job(QtCore.QThread):
+    # Runs work(job) off the GUI thread so the window stays responsive.
+    # work reports progress with job.reportProgress, which raises JobCancelled
+    # once the user has asked to cancel. Its return value comes back to the
+    # GUI thread through resultSignal.
+    progressSignal = QtCore.pyqtSignal(int, int, str)
+    resultSignal = QtCore.pyqtSignal(object)
+    errorSignal = QtCore.pyqtSignal(str)
+    cancelledSignal = QtCore.pyqtSignal()
+
+    def __init__(self, parent, work):
+        super().__init__(parent)
+        self.work = work
+
+    def run(self):
+        try:
+            result = self.work(self)
+        except JobCancelled:
+            self.cancelledSignal.emit()
+        except Exception as error:
+            self.errorSignal.emit(str(error))
+        else:
+            self.resultSignal.emit(result)
+
+    def reportProgress(self, done, total, text):
+        # total = 0 shows a busy indicator for steps without progress.
+        if self.isInterruptionRequested():
+            raise JobCancelled()
+        self.progressSignal.emit(done, total, text)
 
 class Data():
-    def __init__(self, filename):
-        self.obj = Dataset(filename)
+    def __init__(self, filename, progress=None):
+        # A directory or glob pattern opens as one time series.
+        self.obj = openDataset(filename, progress)
         self.globalAttrNames = self.obj.ncattrs()
         self.varNames = self.obj.variables.keys()
 
         # Active variables for drawing
         self.image = "None"
+        self.imageKey = None
         self.filtered = "None"
+        self.front = "None"
+        self.gradient = None
         self.activeImage = "None"
         self.lon = "None"
         self.lat = "None"
         self.mappable = None
 
+        # Filtered images keyed by image fingerprint and filter size.
+        self.filteredCache = LRUCache(FILTER_CACHE_BYTES)
+
+        # Coordinate indexes of this file, keyed by dimension name.
+        self.coordinateIndexes = {}
+
+    def coordinateIndex(self, dimName):
+        # Binary search index of a dimension's coordinate variable, built on
+        # first use.
+        if dimName not in self.coordinateIndexes:
+            if dimName not in self.obj.variables:
+                raise ValueError(dimName + " has no coordinate variable.")
+            self.coordinateIndexes[dimName] = CoordinateIndex(
+                self.obj.variables[dimName])
+        return self.coordinateIndexes[dimName]
+
+    def filteredImage(self, filterSize, numWorkers=FILTER_WORKERS):
+        # Median-filtered active image, shared by the Original, Gradient and
+        # SIED views. Cached arrays are read-only, so a view that wants to
+        # change one has to copy it first and can't corrupt the others. The
+        # filter runs on row bands, on numWorkers threads.
+        key = (self.imageKey, filterSize)
+        filtered = self.filteredCache.get(key)
+        if filtered is None:
+            filtered = bandedFilter(nanMedianFilter, self.image,
+                medianHalo(filterSize), numWorkers, size=filterSize)
+            filtered.setflags(write=False)
+            self.filteredCache.put(key, filtered, filtered.nbytes)
+        return filtered
+
 class CountMaskedOrNaNWin(QtWidgets.QDialog, Ui_CountMaskedOrNaN):
     okSignal = QtCore.pyqtSignal()
 
@@ -157,7 +128,8 @@ class CountMaskedOrNaNWin(QtWidgets.QDialog, Ui_CountMaskedOrNaN):
     @QtCore.pyqtSlot(str)
     def on_comboBoxSelectVar_currentTextChanged(self, currentText):
         self.labelSubset.setText("Subset " +
-            str(self.data.obj.variables[currentText].dimensions))
+            str(self.data.obj.variables[currentText].dimensions) + "\n"
+            + layoutText(self.data.obj.variables[currentText]))
 
 class CountWhereWin(QtWidgets.QDialog, Ui_CountWhere):
     okSignal = QtCore.pyqtSignal()
@@ -180,7 +152,8 @@ class CountWhereWin(QtWidgets.QDialog, Ui_CountWhere):
     @QtCore.pyqtSlot(str)
     def on_comboBoxSelectVar_currentTextChanged(self, currentText):
         self.labelSubset.setText("Subset " +
-            str(self.data.obj.variables[currentText].dimensions))
+            str(self.data.obj.variables[currentText].dimensions) + "\n"
+            + layoutText(self.data.obj.variables[currentText]))
 
 class VisualSetupWin(QtWidgets.QDialog, Ui_VisualSetup):
     okSignal = QtCore.pyqtSignal()
@@ -195,7 +168,8 @@ class VisualSetupWin(QtWidgets.QDialog, Ui_VisualSetup):
     @QtCore.pyqtSlot(str)
     def on_comboBoxSelectVar_currentTextChanged(self, currentText):
         self.labelSubset.setText("Subset " +
-            str(self.data.obj.variables[currentText].dimensions))
+            str(self.data.obj.variables[currentText].dimensions) + "\n"
+            + layoutText(self.data.obj.variables[currentText]))
     
     @QtCore.pyqtSlot()
     def on_buttonOK_clicked(self):
@@ -213,22 +187,44 @@ class VisualSetupWin(QtWidgets.QDialog, Ui_VisualSetup):
         self.okSignal.emit()
     
     def visualSetup(self):
+        # A blank subset, or the "(start, end, ...)" hint, draws the whole
+        # variable with whole lon and lat.
+        text = self.lineEditSubset.text().strip()
+        if not text or text.startswith("("):
+            self.subsetParameters = ""
+            self.lonSubsetPara = ""
+            self.latSubsetPara = ""
+            return
+
         self.subsetParameters = self.lineEditSubset.text().split(",")
+        # A coordinate value subset names its dimensions, so it applies to
+        # lon and lat as it is.
+        byCoordinate = "=" in self.lineEditSubset.text()
+        if byCoordinate:
+            self.subsetParameters = self.lineEditSubset.text()
 
         if (self.lonName not in self.data.varNames or
             self.latName not in self.data.varNames):
             return
 
+        if byCoordinate:
+            self.lonSubsetPara = self.subsetParameters
+            self.latSubsetPara = self.subsetParameters
+            return
+
         # Get variable dimension names in order.
         dimensions = self.data.obj.variables[self.varName].dimensions
 
+        # Entries per dimension: a start, end pair or one start:stop:step.
+        numEntries = 1 if ":" in self.lineEditSubset.text() else 2
+
         # Set lon and lat subset parameters.
-        for i in range(0, len(self.data.obj.variables[self.varName].shape) * 2, 2):
+        for i in range(0, len(dimensions) * numEntries, numEntries):
             # Tip: parameter's coresponding dimension == designated dimension(s)
-            if dimensions[int(i / 2)] in self.data.obj.variables[self.lonName].dimensions:
-                self.lonSubsetPara = self.subsetParameters[i:i + 2]
-            if dimensions[int(i / 2)] in self.data.obj.variables[self.latName].dimensions:
-                self.latSubsetPara = self.subsetParameters[i:i + 2]
+            if dimensions[i // numEntries] in self.data.obj.variables[self.lonName].dimensions:
+                self.lonSubsetPara = self.subsetParameters[i:i + numEntries]
+            if dimensions[i // numEntries] in self.data.obj.variables[self.latName].dimensions:
+                self.latSubsetPara = self.subsetParameters[i:i + numEntries]
 class MFSizeWin(QtWidgets.QDialog, Ui_MedianFilterSize):
     okSignal = QtCore.pyqtSignal()
 
@@ -268,6 +264,8 @@ class Sied_dashboard(QtWidgets.QDialog, Ui_SIED):
         self.hSliderCohesionThr1.setValue(87)
         self.hSliderCohesionThr2.setValue(87)
         self.hSliderCohesionThrBoth.setValue(89)
+        self.hSliderNumThreads.setValue(self.hSliderNumThreads.maximum())
+        self.checkBoxMultiScale.setChecked(False)
     
     @QtCore.pyqtSlot(int)
     def on_hSliderFilterSize_valueChanged(self, value):
@@ -309,6 +307,10 @@ class Sied_dashboard(QtWidgets.QDialog, Ui_SIED):
     def on_hSliderCohesionThrBoth_valueChanged(self, value):
         self.labelCohesionThrBoth.setText("Cohesion threshold (both): " + str(value / 100))
     
+    @QtCore.pyqtSlot(int)
+    def on_hSliderNumThreads_valueChanged(self, value):
+        self.labelNumThreads.setText("Number of threads: " + str(value))
+    
     @QtCore.pyqtSlot()
     def on_buttonResetPara_clicked(self):
         self.resetDashboard()
@@ -340,8 +342,29 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
         self.setupUi(self)
         self.show()
 
+        # SIED window stats and bit-packed front masks already computed,
+        # keyed by image fingerprint and parameters. Filtered images are
+        # cached in Data.filteredCache.
+        self.siedCache = LRUCache(SIED_CACHE_BYTES)
+
+        # Running background job and its name
+        self.job = None
+        self.jobName = None
+
+        # Pyramid view of the drawn image, redrawn after pan, zoom or resize
+        self.imageView = None
+        self.viewUpdatePending = False
+
         # Signals and Slots
-        self.treeWidget.itemClicked.connect(self.printAttribute)
+        self.treeView.clicked.connect(self.printAttribute)
+        self.canvas.mpl_connect("resize_event", self.scheduleViewUpdate)
+
+    def closeEvent(self, event):
+        # Don't destroy the worker thread while it is running.
+        if self.job:
+            self.job.requestInterruption()
+            self.job.wait()
+        event.accept()
     
     @QtCore.pyqtSlot()
     def on_actionExit_triggered(self):
@@ -349,12 +372,22 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
 
     @QtCore.pyqtSlot()
     def on_actionExpandTreeview_triggered(self):
-        self.treeWidget.expandAll()
+        self.treeView.expandAll()
 
     @QtCore.pyqtSlot()
     def on_actionCollapseTreeview_triggered(self):
-        self.treeWidget.collapseAll()
+        self.treeView.collapseAll()
     
+    @QtCore.pyqtSlot(str)
+    def on_lineEditSearch_textChanged(self, text):
+        if not hasattr(self, "treeFilter"):
+            return
+        self.treeFilter.setSearchText(text)
+        # Show the matches under both branches.
+        if text:
+            for row in range(self.treeFilter.rowCount()):
+                self.treeView.expand(self.treeFilter.index(row, 0))
+
     @QtCore.pyqtSlot()
     def on_actionToggleText_triggered(self):
         self.toggleText()
@@ -378,9 +411,34 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
             try:
                 self.statusbar.showMessage(filename)
                 self.data = Data(filename)
-                self.updateTreeWidget()
+                self.updateTreeView()
             except:
                 self.statusbar.showMessage("Oops! We have a problem opening your file")
+
+    @QtCore.pyqtSlot()
+    def on_actionOpenSeries_triggered(self):
+        # Get a directory of nc files, one time step or more each.
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self,
+            "Select a directory of nc files", "C:\\")
+        if directory:
+            self.openSeries(directory)
+
+    def openSeries(self, pattern):
+        # Open the files of a directory or glob pattern as one dataset joined
+        # along time. Files are only read to build the time index, the first
+        # time or when they changed since.
+        def work(job):
+            return Data(pattern, lambda done, total:
+                job.reportProgress(done, total, "Indexing files"))
+        self.startJob(work, self.showSeries, "Opening " + pattern)
+
+    def showSeries(self, data):
+        self.data = data
+        self.updateTreeView()
+        obj = data.obj
+        self.statusbar.showMessage(str(len(obj.paths)) + " files, "
+            + str(obj.dimensions[obj.timeDim]) + " time steps along "
+            + obj.timeDim)
     
     @QtCore.pyqtSlot()
     def on_actionCountMasked_triggered(self):
@@ -412,6 +470,15 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
         except:
             self.statusbar.showMessage("No variables.")
     
+    @QtCore.pyqtSlot()
+    def on_actionSummary_triggered(self):
+        try:
+            # Open parameter window
+            self.summaryWin = CountWhereWin(self, self.data, "Summary")
+            self.summaryWin.okSignal.connect(self.summary)
+        except:
+            self.statusbar.showMessage("No variables.")
+    
     @QtCore.pyqtSlot()
     def on_actionVisualSetup_triggered(self):
         try:
@@ -444,6 +511,13 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
         self.saveFigWin = SaveFigWin(self)
         self.saveFigWin.okSignal.connect(self.saveFig)
     
+    @QtCore.pyqtSlot()
+    def on_buttonCancel_clicked(self):
+        if self.job:
+            self.job.requestInterruption()
+            self.buttonCancel.setEnabled(False)
+            self.progressBar.setFormat("Cancelling...")
+
     @QtCore.pyqtSlot()
     def on_actionSaveDataAsPNG_triggered(self):
         if isinstance(self.data.activeImage, str):
@@ -456,6 +530,52 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
         imsave(filename, self.data.activeImage, vmin, vmax, cmap, 'png')
         
     
+    def jobRunning(self):
+        # True, and asks to wait, while a job runs. Dialogs that start a job
+        # check this before touching the data or the file.
+        if self.job:
+            self.statusbar.showMessage("Please wait for " + self.jobName
+                + " to finish.")
+            return True
+        return False
+
+    def startJob(self, work, onResult, name):
+        # Run work(job) on a worker thread and pass its result to onResult on
+        # the GUI thread. Menus and the tree are disabled meanwhile, since the
+        # netCDF library can't be used from two threads at once.
+        if self.jobRunning():
+            return
+        self.job = Job(self, work)
+        self.jobName = name
+        self.job.progressSignal.connect(self.showProgress)
+        self.job.resultSignal.connect(onResult)
+        self.job.errorSignal.connect(lambda error:
+            self.statusbar.showMessage("Oops! " + name + " failed: " + error))
+        self.job.cancelledSignal.connect(lambda:
+            self.statusbar.showMessage(name + " cancelled."))
+        self.job.finished.connect(self.finishJob)
+
+        self.menubar.setEnabled(False)
+        self.treePanel.setEnabled(False)
+        self.showProgress(0, 0, name)
+        self.progressBar.setHidden(False)
+        self.buttonCancel.setEnabled(True)
+        self.buttonCancel.setHidden(False)
+        self.job.start()
+
+    def showProgress(self, done, total, text):
+        self.progressBar.setRange(0, total)
+        self.progressBar.setValue(done)
+        self.progressBar.setFormat(text + (" %p%" if total else ""))
+
+    def finishJob(self):
+        self.job.deleteLater()
+        self.job = None
+        self.progressBar.setHidden(True)
+        self.buttonCancel.setHidden(True)
+        self.menubar.setEnabled(True)
+        self.treePanel.setEnabled(True)
+
     def toggleText(self):
         self.welcomeLabel.setHidden(True)
         self.canvas.setHidden(True)
@@ -468,59 +588,35 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
         self.navToolbar.setHidden(False)
         self.textEdit.setHidden(True)
 
-    def updateTreeWidget(self):
-        self.treeWidget.clear()
-
-        # Add global attribute branch
-        globalAttrs = QtWidgets.QTreeWidgetItem(self.treeWidget)
-        globalAttrs.setText(0, 'Global attributes')
-
-        # Add variable branch
-        variables = QtWidgets.QTreeWidgetItem(self.treeWidget)
-        variables.setText(0, 'Variables')
-
-        # Add global attributes' names.
-        for globalAttrName in self.data.globalAttrNames:
-            item = QtWidgets.QTreeWidgetItem(globalAttrs)
-            item.setText(0, globalAttrName)
-
-        # Add variable names.
-        for varName in self.data.varNames:
-            item = QtWidgets.QTreeWidgetItem(variables)
-            item.setText(0, varName)
-
-            # Add variable attributes' names.
-            for attrName in self.data.obj.variables[varName].ncattrs():
-                sub_item = QtWidgets.QTreeWidgetItem(item)
-                sub_item.setText(0, attrName)
+    def updateTreeView(self):
+        # Nodes are read from the file as they are expanded.
+        self.treeModel = NcTreeModel(self.data.obj, self)
+        self.treeFilter = NcTreeFilter(self)
+        self.treeFilter.setSourceModel(self.treeModel)
+        self.treeView.setModel(self.treeFilter)
+        self.treeFilter.setSearchText(self.lineEditSearch.text())
     
-    def printAttribute(self, item, column):
+    def printAttribute(self, index):
         # Toggle text editor.
         self.toggleText()
 
-        # get parent name
-        try:
-            parentName = item.parent().text(column)
-        except:
-            parentName = None
-        # Get item name
-        attrName = item.text(column)
+        node = self.treeModel.nodeFromIndex(self.treeFilter.mapToSource(index))
 
         # Print attributes.
         # Check if the item is a variable.
-        if parentName == 'Variables':
-            self.textEdit.append(attrName + ' >> '
-                +str(self.data.obj.variables[attrName]))
+        if node.kind == 'variable':
+            self.textEdit.append(node.name + ' >> '
+                +str(self.data.obj.variables[node.name]))
             
         # Check if the item is a global attribute.
-        elif parentName == 'Global attributes':
-            self.textEdit.append(attrName + ' >> ' +
-                str(self.data.obj.getncattr(attrName)))
+        elif node.kind == 'global':
+            self.textEdit.append(node.name + ' >> ' +
+                str(self.data.obj.getncattr(node.name)))
             
         # The item can still be a variable's attribute.
-        elif parentName:
-            self.textEdit.append(parentName +' >> ' + attrName + ' >> '
-                + str(self.data.obj.variables[parentName].getncattr(attrName)))
+        elif node.kind == 'attribute':
+            self.textEdit.append(node.parent.name +' >> ' + node.name + ' >> '
+                + str(self.data.obj.variables[node.parent.name].getncattr(node.name)))
             
         else:
             self.textEdit.append('This item has no value.')
@@ -528,117 +624,154 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
         # Make next row empty.
         self.textEdit.append('')
 
-    def subsetData(self, varName, subsetParameters):
-        # Get subset parameters from user-input text.
-        if isinstance(subsetParameters, str):
-            subsetParameters = subsetParameters.split(",")
-            p = [int(para) for para in subsetParameters]
-        else:
-            p = [int(para) for para in subsetParameters]
-        
-        numDims = len(self.data.obj.variables[varName].shape)
-
-        # Subset original variable.
-        if len(p) / 2 == 1 and numDims == 1:
-            data = self.data.obj.variables[varName][p[0]:p[1]]
-        if len(p) / 2 == 2 and numDims == 2:
-            data = self.data.obj.variables[varName][p[0]:p[1], p[2]:p[3]]
-        if len(p) / 2 == 3 and numDims == 3:
-            data = np.squeeze(self.data.obj.variables[varName][p[0]:p[1], p[2]:p[3],
-                p[4]:p[5]])
-        if len(p) / 2 == 4 and numDims == 4:
-            data = np.squeeze(self.data.obj.variables[varName][p[0]:p[1], p[2]:p[3],
-                p[4]:p[5], p[6]:p[7]])
+    def subsetRegion(self, varName, subsetParameters):
+        # Subset parameters from user-input text, or a list of its entries.
+        # A blank subset, or the "(start, end, ...)" hint, means the whole
+        # variable.
+        if not isinstance(subsetParameters, str):
+            subsetParameters = ",".join(str(para) for para in subsetParameters)
+        var = self.data.obj.variables[varName]
+        text = subsetParameters.strip()
+        if not text or text.startswith("("):
+            return (slice(None),) * len(var.shape)
+
+        # Subset by coordinate values, e.g. "lat=-10..10, lon=120..150".
+        if "=" in subsetParameters:
+            return coordinateRegion(var, subsetParameters,
+                self.data.coordinateIndex, self.data.obj.dimensions)
+
+        # Index pairs or start:stop:step for any number of dimensions
+        return parseSubset(subsetParameters, var.shape)
+
+    def subsetData(self, varName, subsetParameters, progress=None):
+        region = self.subsetRegion(varName, subsetParameters)
+
+        # Subset original variable, whole chunks at a time.
+        data = readRegion(self.data.obj.variables[varName], region, progress)
+        if len(region) >= 3:
+            data = np.squeeze(data)
 
         return data
     
-    def countMasked(self):
+    def countRegion(self, win):
+        # Variable and region picked in a count dialog
+        return (self.data.obj.variables[win.varName],
+            self.subsetRegion(win.varName, win.subsetParameters))
+
+    def startCount(self, win, countBlock, title, label, ratioLabel):
+        # Count over the chosen region on the worker thread, one chunk-aligned
+        # block at a time, so memory stays bounded on huge variables.
+        if self.jobRunning():
+            return
         try:
-            data = self.subsetData(self.countMaskedOrNaNWin.varName,
-                self.countMaskedOrNaNWin.subsetParameters)
-        except:
-            data = self.data.obj.variables[self.countMaskedOrNaNWin.varName][...]
-        
-        if 0 in data.shape:
+            var, region = self.countRegion(win)
+        except Exception as error:
+            self.statusbar.showMessage("Bad subset: " + str(error))
+            return
+        shape = regionShape(var.shape, region)
+        if 0 in shape:
             self.statusbar.showMessage("Subset result is empty.")
             return
-            
-        numberMasked = np.ma.count_masked(data)
         numberTotal = 1
-        for dim_length in data.shape:
+        for dim_length in shape:
             numberTotal *= dim_length
+        varName = win.varName
 
-        self.textEdit.append("Mask count for " + self.countMaskedOrNaNWin.varName + " :")
-        self.textEdit.append(str(numberMasked) + " masked")
-        self.textEdit.append(str(numberTotal) + " total")
-        self.textEdit.append("masked / total = " + str(numberMasked / numberTotal))
-        self.textEdit.append("")
-        self.toggleText()
-    
-    def countNaN(self):
-        try:
-            data = self.subsetData(self.countMaskedOrNaNWin.varName,
-                self.countMaskedOrNaNWin.subsetParameters)
-        except:
-            data = self.data.obj.variables[self.countMaskedOrNaNWin.varName][...]
-        
-        if 0 in data.shape:
-            self.statusbar.showMessage("Subset result is empty.")
-            return
+        def work(job):
+            return reduceBlocks(var, region, countBlock, lambda done, total:
+                job.reportProgress(done, total, title + " " + varName))
 
-        numberNaN = np.sum(np.isnan(data))
-        numberTotal = 1
-        for dim_length in data.shape:
-            numberTotal *= dim_length
+        def showCount(number):
+            self.textEdit.append(title + " for " + varName + " :")
+            self.textEdit.append(str(number) + " " + label)
+            self.textEdit.append(str(numberTotal) + " total")
+            self.textEdit.append(ratioLabel + " / total = " + str(number / numberTotal))
+            self.textEdit.append("")
+            self.toggleText()
 
-        self.textEdit.append("NaN count for " + self.countMaskedOrNaNWin.varName + " :")
-        self.textEdit.append(str(numberNaN) + " NaN")
-        self.textEdit.append(str(numberTotal) + " total")
-        self.textEdit.append("NaN / total = " + str(numberNaN / numberTotal))
-        self.textEdit.append("")
-        self.toggleText()
+        self.startJob(work, showCount, title)
+
+    def countMasked(self):
+        self.startCount(self.countMaskedOrNaNWin, np.ma.count_masked,
+            "Mask count", "masked", "masked")
+    
+    def countNaN(self):
+        self.startCount(self.countMaskedOrNaNWin, countNaN,
+            "NaN count", "NaN", "NaN")
     
     def countWhere(self):
         try:
-            data = self.subsetData(self.countWhereWin.varName,
-                self.countWhereWin.subsetParameters)
+            varMin = float(self.countWhereWin.varMin)
         except:
-            data = self.data.obj.variables[self.countWhereWin.varName][...]
+            varMin = None
+        try:
+            varMax = float(self.countWhereWin.varMax)
+        except:
+            varMax = None
 
-        if 0 in data.shape:
-            self.statusbar.showMessage("Subset result is empty.")
+        self.startCount(self.countWhereWin,
+            lambda data: countWhere(data, varMin, varMax),
+            "Conditional count", "meet the condition", "conditional count")
+    
+    def summary(self):
+        # Counts, moments, quantiles and histogram of the chosen region from
+        # a single read of each block.
+        if self.jobRunning():
             return
-        
         try:
-            varMin = float(self.countWhereWin.varMin)
+            var, region = self.countRegion(self.summaryWin)
+        except Exception as error:
+            self.statusbar.showMessage("Bad subset: " + str(error))
+            return
+        varName = self.summaryWin.varName
+        try:
+            varMin = float(self.summaryWin.varMin)
         except:
             varMin = None
         try:
-            varMax = float(self.countWhereWin.varMax)
+            varMax = float(self.summaryWin.varMax)
         except:
             varMax = None
-        
-        if varMin and varMax:
-            numberWhere = np.sum(data>=varMin) - np.sum(data>varMax)
-        elif varMin and varMax == None:
-            numberWhere = np.sum(data>=varMin)
-        elif varMin == None and varMax:
-            numberWhere = np.sum(data<=varMax)
-        else:
-            # No limit is specified. Count NaN and mask.
-            numberWhere = np.ma.count_masked(np.ma.masked_invalid(data))
-        numberTotal = 1
-        for dim_length in data.shape:
-            numberTotal *= dim_length
 
-        self.textEdit.append("Conditional count for " + self.countWhereWin.varName + " :")
-        self.textEdit.append(str(numberWhere) + " meet the condition")
-        self.textEdit.append(str(numberTotal) + " total")
-        self.textEdit.append("conditional count / total = " + str(numberWhere / numberTotal))
+        def work(job):
+            return summarize(var, region, varMin, varMax, lambda done, total:
+                job.reportProgress(done, total, "Summary of " + varName))
+
+        self.startJob(work, lambda stats: self.printSummary(varName, stats),
+            "Summary")
+
+    def printSummary(self, varName, stats):
+        if stats.numTotal == 0:
+            self.statusbar.showMessage("Subset result is empty.")
+            return
+        self.textEdit.append("Summary for " + varName + " :")
+        self.textEdit.append(str(stats.numTotal) + " total")
+        self.textEdit.append(str(stats.numMasked) + " masked")
+        self.textEdit.append(str(stats.numNaN) + " NaN")
+        self.textEdit.append(str(stats.numValid) + " valid (finite, not masked)")
+        if stats.varMin is not None or stats.varMax is not None:
+            self.textEdit.append(str(stats.numInRange) + " valid in ["
+                + str(stats.varMin) + ", " + str(stats.varMax) + "]")
+        if stats.numValid:
+            self.textEdit.append("min = " + str(stats.min) + ", max = "
+                + str(stats.max))
+            self.textEdit.append("mean = " + str(stats.mean) + ", std = "
+                + str(stats.std()))
+            self.textEdit.append("percentiles (approximate): " + ", ".join(
+                str(q) + "% = " + str(round(stats.quantile(q / 100), 6))
+                for q in (1, 5, 25, 50, 75, 95, 99)))
+            self.textEdit.append("histogram:")
+            counts, edges = stats.histogram()
+            for count, low, high in zip(counts, edges[:-1], edges[1:]):
+                self.textEdit.append("    [" + str(round(low, 6)) + ", "
+                    + str(round(high, 6)) + "): " + str(count))
         self.textEdit.append("")
         self.toggleText()
-    
+
     def prepareDataToDraw(self):
+        if self.jobRunning():
+            return
+
         # Reset draw actions to disable.
         self.actionOriginal.setEnabled(False)
         self.actionGradient.setEnabled(False)
@@ -648,73 +781,157 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
 
         # Reset active drawing data to "None".
         self.data.image = "None"
+        self.data.imageKey = None
         self.data.lon = "None"
         self.data.lat = "None"
 
+        # Read the dialog here, the worker thread must not touch widgets.
+        win = self.visualSetupWin
+        varName, subsetParameters = win.varName, win.subsetParameters
+        coords = [(win.lonName, win.lonSubsetPara),
+            (win.latName, win.latSubsetPara)]
+        varMin, varMax = win.lineEditMin.text(), win.lineEditMax.text()
+
+        # Tell what the read costs before it starts.
         try:
-            data = self.subsetData(self.visualSetupWin.varName,
-                self.visualSetupWin.subsetParameters)
-            if 0 in data.shape:
-                self.statusbar.showMessage("Subset result is empty.")
-                return
-            if len(data.shape) != 2:
-                self.statusbar.showMessage("Data for drawing must be a 2D array.")
-                return
-
-            # Let's see if there are values to mask.
-            # This step will convert masked values to nan cuz scipy is not compatible with mask.
-            try: data[data.mask] = np.nan
-            except: pass
-            try: data[data < float(self.visualSetupWin.lineEditMin.text())] = np.nan
-            except: pass
-            try: data[data > float(self.visualSetupWin.lineEditMax.text())] = np.nan
-            except: pass
-
-            self.data.image = data
-
-            # Now that we have data to draw, enable these actions.
+            self.statusbar.showMessage("Reading " + varName + ": " + readText(
+                self.data.obj.variables[varName],
+                self.subsetRegion(varName, subsetParameters)))
+        except:
+            pass
+
+        def work(job):
+            # Drawing data found before anything went wrong, and a message.
+            result = {}
+            try:
+                job.reportProgress(0, 0, "Reading " + varName)
+                data = self.subsetData(varName, subsetParameters,
+                    lambda done, total: job.reportProgress(done, total,
+                        "Reading " + varName))
+                if 0 in data.shape:
+                    return result, "Subset result is empty."
+                if len(data.shape) != 2:
+                    return result, "Data for drawing must be a 2D array."
+
+                # Let's see if there are values to mask.
+                # This step will convert masked values to nan cuz scipy is not compatible with mask.
+                # float32 is precise enough for drawing and front detection and
+                # halves the memory of the image and all its filtered copies.
+                # It is the only copy made, a memory-mapped read is a view.
+                mask = np.ma.getmask(data)
+                data = np.array(np.ma.getdata(data), dtype=np.float32)
+                if mask is not np.ma.nomask:
+                    data[mask] = np.nan
+                try: data[data < float(varMin)] = np.nan
+                except: pass
+                try: data[data > float(varMax)] = np.nan
+                except: pass
+
+                result["image"] = data
+                result["imageKey"] = fingerprint(data)
+
+                # See if geographic coordinates are available.
+                for coordName, (name, parameters) in zip(("lon", "lat"), coords):
+                    job.reportProgress(0, 0, "Reading " + name)
+                    coord = self.subsetData(name, parameters)
+                    if 0 in coord.shape:
+                        return result, None
+                    result[coordName] = coord
+
+                return result, ":) Visualization setup is all done."
+            except JobCancelled:
+                raise
+            except:
+                return result, "Warning: visualization setup may be incomplete."
+
+        self.startJob(work, self.showDataToDraw, "Visualization setup")
+
+    def showDataToDraw(self, result):
+        # Result slot of prepareDataToDraw
+        attributes, message = result
+        for name, value in attributes.items():
+            setattr(self.data, name, value)
+
+        # Now that we have data to draw, enable these actions.
+        if "image" in attributes:
             self.actionOriginal.setEnabled(True)
             self.actionGradient.setEnabled(True)
             self.actionSIEDFront.setEnabled(True)
             self.actionSaveDataAsPNG.setEnabled(True)
             self.actionSaveFig.setEnabled(True)
+        if message:
+            self.statusbar.showMessage(message)
 
-            # See if geographic coordinates are available.
-            lon = self.subsetData(self.visualSetupWin.lonName,
-                self.visualSetupWin.lonSubsetPara)
-            if 0 in lon.shape:
-                return
-            self.data.lon = lon
+    def drawGradient(self):
+        filterSize = self.mfSizeWin.filterSize
+        # Reuse the last gradient's buffer unless it is on screen.
+        buffer = None if self.data.activeImage is self.data.gradient \
+            else self.data.gradient
 
-            lat = self.subsetData(self.visualSetupWin.latName,
-                self.visualSetupWin.latSubsetPara)
-            if 0 in lat.shape:
-                return
-            self.data.lat = lat
+        def work(job):
+            # Apply designated filter.
+            job.reportProgress(0, 0, "Median filter")
+            filtered = self.data.filteredImage(filterSize)
 
-            self.statusbar.showMessage(":) Visualization setup is all done.")
-        except:
-            self.statusbar.showMessage("Warning: visualization setup may be incomplete.")
-    
-    def drawGradient(self):
-        # Apply designated filter.
-        self.data.filtered = median_filter(self.data.image, self.mfSizeWin.filterSize)
+            # Create gradient data in one pass.
+            job.reportProgress(0, 0, "Gradient")
+            gradient = bandedFilter(sobelGradient, filtered, SOBEL_HALO,
+                FILTER_WORKERS, output=buffer)
+            return {"filtered": filtered, "gradient": gradient,
+                "activeImage": gradient}
 
-        # Create gradient data.
-        self.data.activeImage = np.sqrt(sobel(self.data.filtered, axis=0)**2 +
-            sobel(self.data.filtered, axis=1)**2)
+        self.startDraw(work, "Gradient")
 
-        # Draw
-        self.pcolor(self.data.activeImage)
-    
     def drawOriginal(self):
-        # Apply designated filter.
-        self.data.activeImage = median_filter(self.data.image, self.mfSizeWin.filterSize)
+        filterSize = self.mfSizeWin.filterSize
+
+        def work(job):
+            # Apply designated filter.
+            job.reportProgress(0, 0, "Median filter")
+            filtered = self.data.filteredImage(filterSize)
+            return {"filtered": filtered, "activeImage": filtered}
+
+        self.startDraw(work, "Median filter")
+
+    def startDraw(self, work, name):
+        # Run a draw job, which also builds the overview pyramid of its
+        # active image off the GUI thread.
+        coords = (None, None) if isinstance(self.data.lon, str) \
+            or isinstance(self.data.lat, str) else (self.data.lon, self.data.lat)
+
+        def drawWork(job):
+            result = work(job)
+            job.reportProgress(0, 0, "Overview")
+            result["pyramid"] = ImagePyramid(result["activeImage"], *coords)
+            return result
+
+        self.startJob(drawWork, self.drawResult, name)
+
+    def drawResult(self, result):
+        # Result slot of the draw jobs: set the new active data and draw it.
+        message = result.pop("message", None)
+        pyramid = result.pop("pyramid", None)
+        for name, value in result.items():
+            setattr(self.data, name, value)
+        if message:
+            self.statusbar.showMessage(message)
 
         # Draw
-        self.pcolor(self.data.activeImage)
+        self.pcolor(self.data.activeImage, pyramid)
+
+    def scheduleViewUpdate(self, *args):
+        # Limits change on x and y one after the other; update once.
+        if not self.viewUpdatePending:
+            self.viewUpdatePending = True
+            QtCore.QTimer.singleShot(0, self.updateView)
 
-    def pcolor(self, array_2D):
+    def updateView(self):
+        self.viewUpdatePending = False
+        if self.imageView and self.imageView.update():
+            self.data.mappable = self.imageView.mappable
+            self.canvas.draw_idle()
+
+    def pcolor(self, array_2D, pyramid=None):
         # Get last used colormap.
         if self.data.mappable:
             cmap = self.data.mappable.get_cmap()
@@ -728,43 +945,107 @@ class MainWindom(QtWidgets.QMainWindow, Ui_MainWindow):
         # Switch to graph viewer.
         self.toggleGraph()
 
-        # Draw
-        if isinstance(self.data.lon, str) or isinstance(self.data.lat, str):
-            self.data.mappable = axes.pcolormesh(array_2D, cmap=cmap, shading='auto')
-        else:
-            self.data.mappable = axes.pcolormesh(self.data.lon, self.data.lat,
-                array_2D, cmap=cmap, shading='auto')
+        # Draw the level of the image pyramid matching the canvas size, the
+        # full-resolution image can be many times larger than the screen.
+        if pyramid is None:
+            if isinstance(self.data.lon, str) or isinstance(self.data.lat, str):
+                pyramid = ImagePyramid(array_2D)
+            else:
+                pyramid = ImagePyramid(array_2D, self.data.lon, self.data.lat)
+        self.imageView = PyramidView(axes, pyramid, cmap)
+        self.data.mappable = self.imageView.mappable
+        axes.callbacks.connect("xlim_changed", self.scheduleViewUpdate)
+        axes.callbacks.connect("ylim_changed", self.scheduleViewUpdate)
 
-        # Add colorbar.
-        self.fig.colorbar(self.data.mappable, ax=axes)
+        # Add colorbar, kept on the view's artist when it is redrawn.
+        self.imageView.colorbar = self.fig.colorbar(self.data.mappable, ax=axes)
         
         # Add this to refresh the figure cuz it doesn't seem to
         # refresh itself when the drawing is done.
         self.fig.canvas.draw()
+        # The layout has settled the axes size now.
+        self.scheduleViewUpdate()
     
     def drawSIEDfront(self):
-        # Apply designated filter.
-        self.data.filtered = median_filter(self.data.image,
-            self.sied_dashboard.hSliderFilterSize.value())
-        
-        # Detect fronts with SIED
-        flag = sied2(self.data.filtered,
-            self.sied_dashboard.hSliderWindowSize.value(),
+        filterSize = self.sied_dashboard.hSliderFilterSize.value()
+        winSize = self.sied_dashboard.hSliderWindowSize.value()
+        numThreads = self.sied_dashboard.hSliderNumThreads.value()
+        # Parameters of the histogram stage
+        statsParameters = (winSize,
             self.sied_dashboard.hSliderWindowStride.value(),
             self.sied_dashboard.hSliderNumTry.value(),
             self.sied_dashboard.hSliderNumClass1.value() / 100,
-            self.sied_dashboard.hSliderNumClass2.value() / 100,
-            self.sied_dashboard.hSliderTheta.value() / 100,
+            self.sied_dashboard.hSliderNumClass2.value() / 100)
+        # Parameters of the theta and cohesion tests
+        testParameters = (self.sied_dashboard.hSliderTheta.value() / 100,
             self.sied_dashboard.hSliderCohesionThr1.value() / 100,
             self.sied_dashboard.hSliderCohesionThr2.value() / 100,
             self.sied_dashboard.hSliderCohesionThrBoth.value() / 100)
-        
-        # Suppress non-front pixels.
-        self.data.activeImage = self.data.filtered
-        self.data.activeImage[~flag.astype(np.bool)] = np.nan
 
-        # Draw.
-        self.pcolor(self.data.activeImage)
+        # The coarse level of the multi-scale mode depends on every threshold.
+        multiScale = self.sied_dashboard.checkBoxMultiScale.isChecked()
+
+        # Reuse the result if these settings were applied to this image before.
+        statsKey = (self.data.imageKey, filterSize) + statsParameters
+        if multiScale:
+            statsKey += ("multi-scale",) + testParameters
+        key = statsKey + testParameters
+
+        def work(job):
+            # Apply designated filter.
+            job.reportProgress(0, 0, "Median filter")
+            filtered = self.data.filteredImage(filterSize, numThreads)
+            result = {"filtered": filtered}
+
+            packedFlag = self.siedCache.get(key)
+            if packedFlag is None:
+                # Only the theta and cohesion tests need to be rerun if the
+                # histogram stage is cached.
+                stats = self.siedCache.get(statsKey)
+                if stats is None:
+                    # Histogram analysis of every SIED window, or only of the
+                    # windows a coarse pass finds candidates.
+                    job.reportProgress(0, 0, "SIED windows")
+                    progress = lambda done, total: job.reportProgress(done,
+                        total, "SIED windows")
+                    if multiScale:
+                        stats = siedWindowStatsMultiScale(filtered,
+                            *(statsParameters + testParameters),
+                            numThreads=numThreads, progress=progress)
+                    else:
+                        stats = siedWindowStats(filtered, *statsParameters,
+                            numThreads=numThreads, progress=progress)
+                    self.siedCache.put(statsKey, stats,
+                        sum(array.nbytes for array in stats.values()))
+
+                # Detect fronts with SIED
+                job.reportProgress(0, 0, "SIED fronts")
+                flag = siedFronts(filtered, winSize, stats, *testParameters,
+                    numThreads=numThreads)
+                # Keep the front mask bit-packed in the cache.
+                packedFlag = np.packbits(flag, axis=-1)
+                self.siedCache.put(key, packedFlag, packedFlag.nbytes)
+
+                # Report windows rejected by the valid pixel count and, in
+                # multi-scale mode, how much of the image was refined.
+                message = (str(np.sum(stats["skipped"])) + " of "
+                    + str(stats["skipped"].size) + " SIED windows skipped "
+                    + "(not enough valid pixels).")
+                if multiScale:
+                    message += (" Refined " + str(np.sum(stats["selected"]))
+                        + " windows (" + str(round(100 * np.mean(stats["selected"]), 1))
+                        + "% of the windows).")
+                result["message"] = message
+            else:
+                flag = np.unpackbits(packedFlag, axis=-1, count=filtered.shape[-1])
+            result["front"] = flag
+
+            # Suppress non-front pixels. Mask instead of writing NaN, so the
+            # shared filtered image is not copied.
+            result["activeImage"] = np.ma.masked_array(filtered, mask=flag == 0)
+            return result
+
+        self.startDraw(work, "SIED")
     
     def saveFig(self):
         filename, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save figure as",
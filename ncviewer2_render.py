@@ -0,0 +1,220 @@
+import numpy as np
+from numba import njit, prange
+from matplotlib.colors import Normalize
+
+# Levels are halved until they fit in this many pixels each way.
+PYRAMID_MIN_SIZE = 512
+
+@njit(parallel=True)
+def halveKernel(image, out):
+# Mean of the valid (non-NaN) pixels of each 2x2 block, NaN only where the
+# whole block is. An odd last row or column makes blocks of its own.
+    (height, width) = image.shape
+    for y in prange(out.shape[0]):
+        for x in range(out.shape[1]):
+            total = 0.0
+            count = 0
+            for i in range(2 * y, min(2 * y + 2, height)):
+                for j in range(2 * x, min(2 * x + 2, width)):
+                    value = image[i, j]
+                    if not np.isnan(value):
+                        total += value
+                        count += 1
+            out[y, x] = total / count if count > 0 else np.nan
+
+def halveImage(image):
+    out = np.empty(((image.shape[0] + 1) // 2, (image.shape[1] + 1) // 2),
+        dtype=image.dtype)
+    halveKernel(image, out)
+    return out
+
+# Largest distance of a coordinate from a regular grid, in pixels, still
+# drawn as a regular grid
+REGULAR_TOLERANCE = 0.1
+
+def halveCoordinate(coord):
+# Centres of the halved pixels: means of pairs along a 1D axis, or of 2x2
+# blocks of a 2D coordinate. An odd 1D axis is extended by one step, so a
+# regular axis stays regular.
+    if coord.ndim == 2:
+        return halveImage(coord)
+    if len(coord) % 2:
+        step = coord[-1] - coord[-2] if len(coord) > 1 else 0.0
+        coord = np.append(coord, coord[-1] + step)
+    return (coord[0::2] + coord[1::2]) / 2
+
+def axisStep(coord):
+# Step of a regular 1D axis, 1 for a single point
+    return (coord[-1] - coord[0]) / (len(coord) - 1) if len(coord) > 1 else 1.0
+
+def isRegular(coord):
+# True if the centres of a 1D axis are evenly spaced, within
+# REGULAR_TOLERANCE of a pixel.
+    step = axisStep(coord)
+    if not np.isfinite(step) or step == 0:
+        return False
+    grid = coord[0] + step * np.arange(len(coord))
+    return bool(np.all(np.abs(coord - grid) <= REGULAR_TOLERANCE * abs(step)))
+
+def separableAxes(lon, lat):
+# 1D lon and lat axes of 2D coordinates where lon only changes along rows
+# and lat along columns (a regular grid stored as 2D), else None.
+    lonAxis = lon[0]
+    latAxis = lat[:, 0]
+    if np.all(np.abs(lon - lonAxis) <= REGULAR_TOLERANCE * abs(axisStep(lonAxis))) \
+        and np.all(np.abs(lat - latAxis[:, np.newaxis])
+        <= REGULAR_TOLERANCE * abs(axisStep(latAxis))):
+        return lonAxis, latAxis
+    return None
+
+class ImagePyramid():
+# An image and its pixel centres at full resolution and halved again and
+# again. A pixel is the mean of the valid pixels it covers, so a block with
+# a single front pixel still shows at every level. Without lon/lat the
+# centres are pixel indexes + 0.5, as pcolormesh(image) draws.
+    def __init__(self, image, lon=None, lat=None, minSize=PYRAMID_MIN_SIZE):
+        level = np.ma.filled(np.ma.asarray(image, dtype=np.float32), np.nan)
+        if lon is None or lat is None:
+            lon = np.arange(level.shape[1]) + 0.5
+            lat = np.arange(level.shape[0]) + 0.5
+        else:
+            lon = np.ma.filled(np.ma.asarray(lon, dtype=np.float64), np.nan)
+            lat = np.ma.filled(np.ma.asarray(lat, dtype=np.float64), np.nan)
+            if lon.ndim == 2 and lon.shape == lat.shape:
+                (lon, lat) = separableAxes(lon, lat) or (lon, lat)
+        # Regular grids are drawn as images, curvilinear ones as meshes.
+        self.regular = lon.ndim == 1 and isRegular(lon) and isRegular(lat)
+        self.levels = [(level, lon, lat)]
+        while max(level.shape) > minSize and min(level.shape) > 1:
+            level = halveImage(level)
+            lon = halveCoordinate(lon)
+            lat = halveCoordinate(lat)
+            self.levels.append((level, lon, lat))
+
+        # Colour limits of the full image, as pcolormesh would pick. The
+        # coarsest level tells cheaply if there is any valid pixel.
+        if np.isnan(self.levels[-1][0]).all():
+            (self.vmin, self.vmax) = (0.0, 1.0)
+        else:
+            self.vmin = float(np.nanmin(self.levels[0][0]))
+            self.vmax = float(np.nanmax(self.levels[0][0]))
+
+class PyramidView():
+# Draws an ImagePyramid on axes at the level matching the axes size in
+# pixels, cropped to what is in view with a margin. update() after a pan,
+# zoom or resize switches levels or re-crops when needed, so a finer level
+# is only drawn for the part of the image that is zoomed in on. A regular
+# grid keeps one image artist whose data is swapped; a mesh is redrawn with
+# the colormap and limits of the mesh it replaces. colorbar, if set, is
+# pointed at the new mesh.
+    def __init__(self, axes, pyramid, cmap):
+        self.axes = axes
+        self.pyramid = pyramid
+        self.cmap = cmap
+        self.norm = Normalize(pyramid.vmin, pyramid.vmax)
+        self.mappable = None
+        self.colorbar = None
+        self.level = None
+        # Drawn part of the image as fractions (row0, row1, col0, col1)
+        self.window = None
+        self.update()
+        # Limits stay where the first drawing put them. pcolormesh only asks
+        # for autoscaling, so do it before turning it off.
+        axes.autoscale_view()
+        axes.set_autoscale_on(False)
+
+    def visibleWindow(self):
+        # Fractions of the image rows and columns in view, found on the
+        # coarsest level with one pixel of margin.
+        if self.mappable is None:
+            return (0.0, 1.0, 0.0, 1.0)
+        image, lon, lat = self.pyramid.levels[-1]
+        (x0, x1) = sorted(self.axes.get_xlim())
+        (y0, y1) = sorted(self.axes.get_ylim())
+        if lon.ndim == 1:
+            (lon, lat) = (lon[np.newaxis, :], lat[:, np.newaxis])
+        inside = (lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1)
+        inside = np.broadcast_to(inside, image.shape)
+        rows = np.flatnonzero(inside.any(axis=1))
+        cols = np.flatnonzero(inside.any(axis=0))
+        if rows.size == 0 or cols.size == 0:
+            return None
+        (height, width) = image.shape
+        return (max(rows[0] - 1, 0) / height, min(rows[-1] + 2, height) / height,
+            max(cols[0] - 1, 0) / width, min(cols[-1] + 2, width) / width)
+
+    def pickLevel(self, window):
+        # Coarsest level with at least one pixel per screen pixel
+        (height, width) = self.pyramid.levels[0][0].shape
+        box = self.axes.get_window_extent()
+        ratio = min((window[1] - window[0]) * height / max(box.height, 1),
+            (window[3] - window[2]) * width / max(box.width, 1))
+        level = int(np.floor(np.log2(ratio))) if ratio > 1 else 0
+        return min(level, len(self.pyramid.levels) - 1)
+
+    def update(self):
+        # Redraw if the view needs another level or goes past the drawn
+        # part. True if it was redrawn.
+        visible = self.visibleWindow()
+        if visible is None:
+            return False
+        level = self.pickLevel(visible)
+        if level == self.level and self.window[0] <= visible[0] \
+            and visible[1] <= self.window[1] and self.window[2] <= visible[2] \
+            and visible[3] <= self.window[3]:
+            return False
+        # Half the visible size of margin, so small pans don't redraw.
+        (rowMargin, colMargin) = ((visible[1] - visible[0]) / 2,
+            (visible[3] - visible[2]) / 2)
+        self.window = (max(visible[0] - rowMargin, 0.0),
+            min(visible[1] + rowMargin, 1.0), max(visible[2] - colMargin, 0.0),
+            min(visible[3] + colMargin, 1.0))
+        self.level = level
+        self.draw()
+        return True
+
+    def draw(self):
+        image, lon, lat = self.pyramid.levels[self.level]
+        (height, width) = image.shape
+        rows = slice(int(self.window[0] * height),
+            int(np.ceil(self.window[1] * height)))
+        cols = slice(int(self.window[2] * width),
+            int(np.ceil(self.window[3] * width)))
+        if self.pyramid.regular:
+            self.drawRaster(image[rows, cols], lon[cols], lat[rows],
+                axisStep(lon), axisStep(lat))
+            return
+        if lon.ndim == 1:
+            (lon, lat) = (lon[cols], lat[rows])
+        else:
+            (lon, lat) = (lon[rows, cols], lat[rows, cols])
+        # Colormap and limits may have been changed on the old mesh, e.g.
+        # from the toolbar.
+        (cmap, norm) = (self.cmap, self.norm) if self.mappable is None \
+            else (self.mappable.get_cmap(), self.mappable.norm)
+        mappable = self.axes.pcolormesh(lon, lat, image[rows, cols],
+            cmap=cmap, norm=norm, shading='auto')
+        if self.mappable is not None:
+            self.mappable.remove()
+        self.mappable = mappable
+        if self.colorbar is not None:
+            self.colorbar.update_normal(mappable)
+
+    def drawRaster(self, image, lon, lat, lonStep, latStep):
+        # Image of a regular grid, the same picture as pcolormesh without a
+        # quad per pixel. Descending axes are turned around (views, no copy)
+        # so the axes don't get inverted. Later crops and levels only swap
+        # the data and extent of the image.
+        if lonStep < 0:
+            (image, lon, lonStep) = (image[:, ::-1], lon[::-1], -lonStep)
+        if latStep < 0:
+            (image, lat, latStep) = (image[::-1], lat[::-1], -latStep)
+        extent = (lon[0] - lonStep / 2, lon[-1] + lonStep / 2,
+            lat[0] - latStep / 2, lat[-1] + latStep / 2)
+        if self.mappable is None:
+            self.mappable = self.axes.imshow(image, cmap=self.cmap,
+                norm=self.norm, extent=extent, origin='lower', aspect='auto',
+                interpolation='nearest')
+        else:
+            self.mappable.set_data(image)
+            self.mappable.set_extent(extent)
@@ -0,0 +1,478 @@
+import numpy as np
+from numba import njit, prange, config, get_num_threads, set_num_threads
+
+@njit
+def histogramAnalysis(data, pst, winSize, numClass1_threshold,
+    numClass2_threshold):
+# Histogram analysis of one window for every possible segmenting threshold.
+# Each pixel is binned once by the number of thresholds it is greater than or
+# equal to, so cumulative sums over the bins give the count, mean and variance
+# of class1 (data < pst[i]) and class2 (data >= pst[i]) for all thresholds.
+    numTry = len(pst)
+    theta = np.zeros(numTry)
+    numClass1 = np.zeros(numTry)
+    numClass2 = np.zeros(numTry)
+
+    # Sums are taken around the window mean to keep the variance accurate.
+    shift = np.nanmean(data)
+    binCount = np.zeros(numTry + 1)
+    binSum = np.zeros(numTry + 1)
+    binSumSq = np.zeros(numTry + 1)
+    for value in data:
+        if np.isnan(value):
+            continue
+        # Pixel is in class1 for thresholds pst[k:] and in class2 for pst[:k].
+        k = np.searchsorted(pst, value, side='right')
+        d = value - shift
+        binCount[k] += 1
+        binSum[k] += d
+        binSumSq[k] += d * d
+
+    total = np.sum(binCount)
+    totalSum = np.sum(binSum)
+    totalSumSq = np.sum(binSumSq)
+    n1 = 0.0
+    s1 = 0.0
+    q1 = 0.0
+    for i in range(numTry):
+        # Cumulate class1 up to threshold i; class2 is the rest.
+        n1 += binCount[i]
+        s1 += binSum[i]
+        q1 += binSumSq[i]
+        n2 = total - n1
+        numClass1[i] = n1
+        numClass2[i] = n2
+        # Check if we have enough data points.
+        if (n1 < winSize ** 2 * numClass1_threshold or
+            n2 < winSize ** 2 * numClass2_threshold):
+            continue
+        s2 = totalSum - s1
+        q2 = totalSumSq - q1
+        # mean sst of class1 and class2 (relative to the shift)
+        meanTemp1 = s1 / n1
+        meanTemp2 = s2 / n2
+        # sst variance of class1 and class2
+        variance1 = max(q1 / n1 - meanTemp1 ** 2, 0.0)
+        variance2 = max(q2 / n2 - meanTemp2 ** 2, 0.0)
+        # within-cluster variance (wcv)
+        wcv = n1 / (n1 + n2) * variance1 + n2 / (n1 + n2) * variance2
+
+        # between-cluster variance (bcv)
+        bcv = n1 * n2 / (n1 + n2) * (meanTemp1 - meanTemp2) ** 2
+
+        # the ratio, denoted theta, used to decide whether one or two
+        # populations are present
+        theta[i] = bcv / (wcv + bcv)
+
+    return theta, numClass1, numClass2
+
+@njit
+def windowStarts(length, winSize, stride):
+# Top (or left) index of every window along one axis, as walked by sied2.
+# We dont collect pixels on the image's edge, so windows near the far edge
+# are shifted back inside the image.
+    starts = np.empty(len(range(0,length-1,stride)), dtype=np.int64)
+    n = 0
+    for pos in range(0,length-1,stride):
+        tl = pos + 1
+        br = pos + winSize
+        if br >= length - 1:
+            br = length - 2
+            tl = br - winSize + 1
+        starts[n] = tl
+        n += 1
+    return starts
+
+@njit
+def validCountTable(sst):
+# Summed-area table of valid (non-NaN) pixels. The number of valid pixels in
+# any window is then four lookups away. uint32 is enough for 4e9 pixels.
+    (height,width) = sst.shape
+    table = np.zeros((height + 1, width + 1), dtype=np.uint32)
+    for y in range(height):
+        rowCount = 0
+        for x in range(width):
+            if not np.isnan(sst[y,x]):
+                rowCount += 1
+            table[y+1,x+1] = table[y,x+1] + rowCount
+    return table
+
+@njit
+def enoughValidPixels(table, tl_y, tl_x, winSize, numClass1_threshold,
+    numClass2_threshold):
+# Whether a window has enough valid pixels to ever pass the class size
+# checks of the histogram analysis. Both classes need at least
+# ceil(winSize ** 2 * threshold) pixels, so windows with fewer valid pixels
+# than the two together fail for every threshold.
+    br_y = tl_y + winSize
+    br_x = tl_x + winSize
+    numValid = ((np.int64(table[br_y,br_x]) - np.int64(table[tl_y,br_x]))
+        - (np.int64(table[br_y,tl_x]) - np.int64(table[tl_y,tl_x])))
+    return numValid >= (np.ceil(winSize ** 2 * numClass1_threshold)
+        + np.ceil(winSize ** 2 * numClass2_threshold))
+
+@njit
+def analyseWindow(sst, tl_y, tl_x, winSize, numTry, numClass1_threshold,
+    numClass2_threshold):
+# Histogram analysis of one window plus the cohesion counts at its best
+# threshold. None of this depends on the theta or cohesion thresholds.
+# Returns thetaMax, pst_opt, numC1, numC2, r1, r2. Windows without a valid
+# threshold get thetaMax = 0 and pst_opt = NaN.
+    br_y = tl_y + winSize - 1
+    br_x = tl_x + winSize - 1
+
+    # This window's data and info
+    data = sst[tl_y:br_y+1,tl_x:br_x+1].flatten()
+    winMin = np.nanmin(data)
+    winMax = np.nanmax(data)
+    # Get possable segmenting thresholds.
+    pst = np.linspace(winMin,winMax,numTry)
+    # Histogram analysis
+    theta, numClass1, numClass2 = histogramAnalysis(data, pst, winSize,
+        numClass1_threshold, numClass2_threshold)
+    # Find max theta and its index.
+    theta_idx = 0
+    thetaMax = 0.0
+    index = -1
+    for currentTheta in theta:
+        if currentTheta > thetaMax:
+            thetaMax = currentTheta
+            index = theta_idx
+        theta_idx += 1
+    if index < 0:
+        return 0.0, np.nan, 0.0, 0.0, 0, 0
+    pst_opt = pst[index]
+    numC1 = numClass1[index]
+    numC2 = numClass2[index]
+
+    # Cohesion test
+    # r1: total number of comparisons between center pixels and neighbors
+    # that both belong to population 1.
+    r1 = 0
+    # r2 is similarly defined.
+    r2 = 0
+    # Check only one neighbor (top)
+    for y in range(tl_y,br_y+1):
+        for x in range(tl_x,br_x+1):
+            # Count r1.
+            if sst[y,x] < pst_opt and sst[y-1,x] < pst_opt:
+                r1 += 1
+            # Count r2.
+            if sst[y,x] >= pst_opt and sst[y-1,x] >= pst_opt:
+                r2 += 1
+    return thetaMax, pst_opt, numC1, numC2, r1, r2
+
+@njit
+def passWindow(thetaMax, numC1, numC2, r1, r2, theta_threshold,
+    cohesion1_threshold, cohesion2_threshold, cohesionBoth_threshold):
+# Now lets determine if this window pass the histogram analysis
+# and the cohesion test.
+    if thetaMax <= 0 or thetaMax < theta_threshold:
+        return False
+    if (r1 / numC1 < cohesion1_threshold or
+        r2 / numC2 < cohesion2_threshold or
+        (r1 + r2) / (numC1 + numC2) < cohesionBoth_threshold):
+        return False
+    return True
+
+@njit
+def testWindow(sst, tl_y, tl_x, winSize, numTry, numClass1_threshold,
+    numClass2_threshold, theta_threshold, cohesion1_threshold,
+    cohesion2_threshold, cohesionBoth_threshold):
+# Histogram analysis and cohesion test of one window. Returns whether the
+# window contains a front and the optimal segmenting threshold.
+    thetaMax, pst_opt, numC1, numC2, r1, r2 = analyseWindow(sst, tl_y, tl_x,
+        winSize, numTry, numClass1_threshold, numClass2_threshold)
+    passed = passWindow(thetaMax, numC1, numC2, r1, r2, theta_threshold,
+        cohesion1_threshold, cohesion2_threshold, cohesionBoth_threshold)
+    return passed, pst_opt
+
+@njit
+def isEdgePixel(sst, y, x, pst_opt):
+# Mark pixels on warm side of the front, not two sides, as was
+# described in the paper.
+    return (sst[y,x] >= pst_opt and (
+        sst[y-1,x] < pst_opt or
+        sst[y+1,x] < pst_opt or
+        sst[y,x-1] < pst_opt or
+        sst[y,x+1] < pst_opt))
+
+@njit
+def sied2(sst, winSize=16, stride=8, numTry=64, numClass1_threshold=0.3,
+    numClass2_threshold=0.3, theta_threshold=0.7, cohesion1_threshold=0.87,
+    cohesion2_threshold=0.87, cohesionBoth_threshold=0.89):
+# SIED Cayula-Cornillon algorithm for detecting fronts in SST images.
+# The original contour-following algorithm is not included.
+# Works on float32 or float64 images and returns a uint8 front mask.
+    (height,width) = sst.shape
+    front = np.zeros((height,width), dtype=np.uint8)
+    tl_ys = windowStarts(height, winSize, stride)
+    tl_xs = windowStarts(width, winSize, stride)
+    # Reject cloud/land-dominated windows before any per-window work.
+    table = validCountTable(sst)
+    for tl_y in tl_ys:
+        for tl_x in tl_xs:
+            if not enoughValidPixels(table, tl_y, tl_x, winSize,
+                numClass1_threshold, numClass2_threshold):
+                continue
+            passed, pst_opt = testWindow(sst, tl_y, tl_x, winSize, numTry,
+                numClass1_threshold, numClass2_threshold, theta_threshold,
+                cohesion1_threshold, cohesion2_threshold,
+                cohesionBoth_threshold)
+            if not passed:
+                continue
+            # Location of edge pixels
+            for y in range(tl_y,tl_y+winSize):
+                for x in range(tl_x,tl_x+winSize):
+                    if isEdgePixel(sst, y, x, pst_opt):
+                        front[y,x] = 1
+
+    return front
+
+@njit(parallel=True)
+def windowStatsKernel(sst, table, tl_ys, tl_xs, selected, winSize, numTry,
+    numClass1_threshold, numClass2_threshold):
+# Stage 1: analyseWindow on every selected window, spread over threads.
+# table is the validCountTable of sst, used to reject cloud/land-dominated
+# windows before any per-window work.
+    numRows = len(tl_ys)
+    numCols = len(tl_xs)
+    thetaMax = np.zeros((numRows, numCols))
+    pstOpt = np.full((numRows, numCols), np.nan)
+    numC1 = np.zeros((numRows, numCols))
+    numC2 = np.zeros((numRows, numCols))
+    r1 = np.zeros((numRows, numCols), dtype=np.int64)
+    r2 = np.zeros((numRows, numCols), dtype=np.int64)
+    skipped = np.zeros((numRows, numCols), dtype=np.bool_)
+    for k in prange(numRows * numCols):
+        i = k // numCols
+        j = k % numCols
+        if not selected[i,j]:
+            continue
+        if not enoughValidPixels(table, tl_ys[i], tl_xs[j], winSize,
+            numClass1_threshold, numClass2_threshold):
+            skipped[i,j] = True
+            continue
+        (thetaMax[i,j], pstOpt[i,j], numC1[i,j], numC2[i,j], r1[i,j],
+            r2[i,j]) = analyseWindow(sst, tl_ys[i], tl_xs[j], winSize, numTry,
+            numClass1_threshold, numClass2_threshold)
+    return thetaMax, pstOpt, numC1, numC2, r1, r2, skipped
+
+@njit
+def windowPassKernel(thetaMax, numC1, numC2, r1, r2, theta_threshold,
+    cohesion1_threshold, cohesion2_threshold, cohesionBoth_threshold):
+# Stage 2: pass/fail of every window. Only a few operations per window.
+    (numRows, numCols) = thetaMax.shape
+    passed = np.zeros((numRows, numCols), dtype=np.bool_)
+    for i in range(numRows):
+        for j in range(numCols):
+            passed[i,j] = passWindow(thetaMax[i,j], numC1[i,j], numC2[i,j],
+                r1[i,j], r2[i,j], theta_threshold, cohesion1_threshold,
+                cohesion2_threshold, cohesionBoth_threshold)
+    return passed
+
+@njit(parallel=True)
+def markFrontsKernel(sst, winSize, tl_ys, tl_xs, pstOpt, passed):
+# Stage 3: mark edge pixels of the windows that passed. Each thread owns
+# whole image rows, so overlapping windows never write the same pixel from
+# two threads.
+    (height,width) = sst.shape
+    front = np.zeros((height,width), dtype=np.uint8)
+    for y in prange(height):
+        for i in range(len(tl_ys)):
+            if y < tl_ys[i] or y >= tl_ys[i] + winSize:
+                continue
+            for j in range(len(tl_xs)):
+                if not passed[i,j]:
+                    continue
+                pst_opt = pstOpt[i,j]
+                for x in range(tl_xs[j],tl_xs[j]+winSize):
+                    if isEdgePixel(sst, y, x, pst_opt):
+                        front[y,x] = 1
+
+    return front
+
+@njit(parallel=True)
+def tileFrontsKernel(sst, offset_y, offset_x, tl_ys, tl_xs, winSize, numTry,
+    numClass1_threshold, numClass2_threshold, theta_threshold,
+    cohesion1_threshold, cohesion2_threshold, cohesionBoth_threshold,
+    tile_y0, tile_y1, tile_x0, tile_x1):
+# SIED on one tile of a larger image. sst is the part of the image starting at
+# (offset_y, offset_x) that holds every window in tl_ys/tl_xs (image
+# coordinates) plus one pixel around them. Only the tile
+# [tile_y0:tile_y1, tile_x0:tile_x1] of the front mask is returned.
+    numRows = len(tl_ys)
+    numCols = len(tl_xs)
+    table = validCountTable(sst)
+    pstOpt = np.full((numRows, numCols), np.nan)
+    passed = np.zeros((numRows, numCols), dtype=np.bool_)
+    for k in prange(numRows * numCols):
+        i = k // numCols
+        j = k % numCols
+        tl_y = tl_ys[i] - offset_y
+        tl_x = tl_xs[j] - offset_x
+        if not enoughValidPixels(table, tl_y, tl_x, winSize,
+            numClass1_threshold, numClass2_threshold):
+            continue
+        thetaMax, pstOpt[i,j], numC1, numC2, r1, r2 = analyseWindow(sst, tl_y,
+            tl_x, winSize, numTry, numClass1_threshold, numClass2_threshold)
+        passed[i,j] = passWindow(thetaMax, numC1, numC2, r1, r2,
+            theta_threshold, cohesion1_threshold, cohesion2_threshold,
+            cohesionBoth_threshold)
+
+    front = np.zeros((tile_y1 - tile_y0, tile_x1 - tile_x0), dtype=np.uint8)
+    for y in prange(tile_y0, tile_y1):
+        for i in range(numRows):
+            if y < tl_ys[i] or y >= tl_ys[i] + winSize:
+                continue
+            for j in range(numCols):
+                if not passed[i,j]:
+                    continue
+                for x in range(max(tl_xs[j], tile_x0),
+                    min(tl_xs[j] + winSize, tile_x1)):
+                    if isEdgePixel(sst, y - offset_y, x - offset_x, pstOpt[i,j]):
+                        front[y - tile_y0,x - tile_x0] = 1
+
+    return front
+
+class NumbaThreads():
+# Context manager capping the numba thread count (None = all cores).
+    def __init__(self, numThreads):
+        self.numThreads = numThreads
+
+    def __enter__(self):
+        self.previousThreads = get_num_threads()
+        if self.numThreads:
+            set_num_threads(max(1, min(self.numThreads,
+                config.NUMBA_NUM_THREADS)))
+
+    def __exit__(self, *exc):
+        set_num_threads(self.previousThreads)
+
+def siedWindowStats(sst, winSize=16, stride=8, numTry=64,
+    numClass1_threshold=0.3, numClass2_threshold=0.3, numThreads=None,
+    selected=None, progress=None):
+# Histogram stage of SIED. Returns per-window arrays in a dict: window
+# corners (tl_ys, tl_xs), best theta (thetaMax), best threshold (pstOpt),
+# class counts (numC1, numC2), cohesion counts (r1, r2), the windows
+# rejected by the valid pixel count (skipped) and the windows analysed
+# (selected, all of them unless a selection is given).
+# If given, progress(windowsDone, windowsTotal) is called about a hundred
+# times along the way; an exception raised by it aborts the run.
+    (height,width) = sst.shape
+    tl_ys = windowStarts(height, winSize, stride)
+    tl_xs = windowStarts(width, winSize, stride)
+    if selected is None:
+        selected = np.ones((len(tl_ys), len(tl_xs)), dtype=np.bool_)
+    names = ("thetaMax", "pstOpt", "numC1", "numC2", "r1", "r2", "skipped")
+    table = validCountTable(sst)
+    with NumbaThreads(numThreads):
+        if progress is None:
+            stats = dict(zip(names, windowStatsKernel(sst, table, tl_ys, tl_xs,
+                selected, winSize, numTry, numClass1_threshold,
+                numClass2_threshold)))
+        else:
+            # Analyse a band of window rows at a time to report progress.
+            step = max(len(tl_ys) // 100, 1)
+            parts = []
+            for i in range(0, len(tl_ys), step):
+                progress(i * len(tl_xs), selected.size)
+                parts.append(windowStatsKernel(sst, table, tl_ys[i:i + step],
+                    tl_xs, selected[i:i + step], winSize, numTry,
+                    numClass1_threshold, numClass2_threshold))
+            progress(selected.size, selected.size)
+            stats = {name: np.concatenate([part[n] for part in parts])
+                for n, name in enumerate(names)}
+    stats.update(tl_ys=tl_ys, tl_xs=tl_xs, selected=selected)
+    return stats
+
+def decimate(sst, factor):
+# Coarser image made of the NaN-ignoring mean of factor x factor blocks.
+    (height,width) = sst.shape
+    padded = np.full((-(-height // factor) * factor,
+        -(-width // factor) * factor), np.nan, dtype=sst.dtype)
+    padded[:height,:width] = sst
+    blocks = padded.reshape(padded.shape[0] // factor, factor,
+        padded.shape[1] // factor, factor)
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1,3))
+    total = np.where(valid, blocks, 0).sum(axis=(1,3), dtype=np.float64)
+    coarse = np.full(count.shape, np.nan, dtype=sst.dtype)
+    np.divide(total, count, out=coarse, where=count > 0, casting="unsafe")
+    return coarse
+
+def siedWindowStatsMultiScale(sst, winSize=16, stride=8, numTry=64,
+    numClass1_threshold=0.3, numClass2_threshold=0.3, theta_threshold=0.7,
+    cohesion1_threshold=0.87, cohesion2_threshold=0.87,
+    cohesionBoth_threshold=0.89, factor=4, margin=0.1, numThreads=None,
+    progress=None):
+# Coarse-to-fine histogram stage. SIED first runs on a decimated image, with
+# windows covering the same area as the full resolution ones (at least 8
+# pixels wide) and every threshold lowered by margin. Full resolution
+# windows are only analysed near the coarse windows that pass; all other
+# windows are left out, as if they had failed the histogram analysis.
+# Smooth SST gradients pass the theta test almost everywhere, so the coarse
+# windows have to pass the cohesion test too. Same output as
+# siedWindowStats, where selected tells which windows were refined.
+    (height,width) = sst.shape
+    coarse = decimate(sst, factor)
+    coarseWinSize = max(winSize // factor, 8)
+    coarseStats = siedWindowStats(coarse, coarseWinSize,
+        max(coarseWinSize // 2, 1), numTry, numClass1_threshold,
+        numClass2_threshold, numThreads)
+
+    # Full resolution area of the bimodal coarse windows, grown by half a
+    # window so fronts near their edges are not missed.
+    candidate = np.zeros((height, width), dtype=np.bool_)
+    grow = winSize // 2
+    passed = siedWindowPass(coarseStats, theta_threshold - margin,
+        cohesion1_threshold - margin, cohesion2_threshold - margin,
+        cohesionBoth_threshold - margin)
+    for i, j in zip(*np.nonzero(passed)):
+        y0 = coarseStats["tl_ys"][i] * factor
+        x0 = coarseStats["tl_xs"][j] * factor
+        candidate[max(y0 - grow, 0):y0 + coarseWinSize * factor + grow,
+            max(x0 - grow, 0):x0 + coarseWinSize * factor + grow] = True
+
+    # Select the windows that overlap the candidate area.
+    table = np.zeros((height + 1, width + 1), dtype=np.int64)
+    table[1:,1:] = candidate.cumsum(axis=0).cumsum(axis=1)
+    tl_ys = windowStarts(height, winSize, stride)[:,None]
+    tl_xs = windowStarts(width, winSize, stride)[None,:]
+    numCandidate = (table[tl_ys + winSize, tl_xs + winSize]
+        - table[tl_ys, tl_xs + winSize] - table[tl_ys + winSize, tl_xs]
+        + table[tl_ys, tl_xs])
+    return siedWindowStats(sst, winSize, stride, numTry, numClass1_threshold,
+        numClass2_threshold, numThreads, numCandidate > 0, progress)
+
+def siedWindowPass(stats, theta_threshold=0.7, cohesion1_threshold=0.87,
+    cohesion2_threshold=0.87, cohesionBoth_threshold=0.89):
+# Decision stage of SIED. Cheap enough to rerun on every slider change.
+    return windowPassKernel(stats["thetaMax"], stats["numC1"], stats["numC2"],
+        stats["r1"], stats["r2"], theta_threshold, cohesion1_threshold,
+        cohesion2_threshold, cohesionBoth_threshold)
+
+def siedMarkFronts(sst, winSize, stats, passed, numThreads=None):
+# Edge marking stage of SIED.
+    with NumbaThreads(numThreads):
+        return markFrontsKernel(sst, winSize, stats["tl_ys"], stats["tl_xs"],
+            stats["pstOpt"], passed)
+
+def siedFronts(sst, winSize, stats, theta_threshold=0.7,
+    cohesion1_threshold=0.87, cohesion2_threshold=0.87,
+    cohesionBoth_threshold=0.89, numThreads=None):
+# Decision and edge marking stages, run on the output of siedWindowStats.
+    passed = siedWindowPass(stats, theta_threshold, cohesion1_threshold,
+        cohesion2_threshold, cohesionBoth_threshold)
+    return siedMarkFronts(sst, winSize, stats, passed, numThreads)
+
+def sied2Parallel(sst, winSize=16, stride=8, numTry=64, numClass1_threshold=0.3,
+    numClass2_threshold=0.3, theta_threshold=0.7, cohesion1_threshold=0.87,
+    cohesion2_threshold=0.87, cohesionBoth_threshold=0.89, numThreads=None):
+# Multi-core sied2 built from the stages above. The front mask is identical
+# to the serial one. numThreads caps the number of threads used.
+    stats = siedWindowStats(sst, winSize, stride, numTry, numClass1_threshold,
+        numClass2_threshold, numThreads)
+    return siedFronts(sst, winSize, stats, theta_threshold,
+        cohesion1_threshold, cohesion2_threshold, cohesionBoth_threshold,
+        numThreads)
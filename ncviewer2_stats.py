@@ -0,0 +1,185 @@
+import numpy as np
+
+from ncviewer2_io import READ_BYTES, regionBlocks
+
+def reduceBlocks(var, region, countBlock, progress=None, maxBytes=READ_BYTES):
+# Sum of countBlock(data) over the blocks of a region, so only one block is
+# in memory at a time. Counts are exact whatever the block size, since every
+# element is counted once. progress(blocksDone, numBlocks) is called after
+# each block if given.
+    numBlocks, blocks = regionBlocks(var, region, maxBytes)
+    total = 0
+    for numDone, block in enumerate(blocks):
+        # Fully masked blocks give a masked count.
+        total += int(np.ma.filled(countBlock(var[block]), 0))
+        if progress:
+            progress(numDone + 1, numBlocks)
+    return total
+
+def countNaN(data):
+# NaN that are not masked, like np.sum(np.isnan(data)).
+    return np.sum(np.isnan(data))
+
+def countWhere(data, varMin=None, varMax=None):
+# Values in [varMin, varMax]. With no limits, NaN and masked values are
+# counted instead.
+    if varMin and varMax:
+        return np.sum(data>=varMin) - np.sum(data>varMax)
+    elif varMin and varMax == None:
+        return np.sum(data>=varMin)
+    elif varMin == None and varMax:
+        return np.sum(data<=varMax)
+    # No limit is specified. Count NaN and mask.
+    return np.ma.count_masked(np.ma.masked_invalid(data))
+
+# Bins of the SummaryStats histogram. Quantiles are within one bin width,
+# (max - min) / HISTOGRAM_BINS at worst.
+HISTOGRAM_BINS = 4096
+
+class SummaryStats():
+# Mergeable one-pass accumulator of element counts, min, max, mean and
+# variance (Welford/Chan updates) and a fixed-bin histogram for approximate
+# quantiles. Feed it blocks with update; accumulators of separate parts of a
+# variable combine with merge.
+    def __init__(self, varMin=None, varMax=None, numBins=HISTOGRAM_BINS):
+        # Optional limits of the range count
+        self.varMin = varMin
+        self.varMax = varMax
+        self.numTotal = 0
+        self.numMasked = 0
+        self.numNaN = 0
+        self.numValid = 0
+        self.numInRange = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Bin k holds [lo + k * width, lo + (k + 1) * width); the last bin
+        # also holds hi. numBins must be even.
+        self.lo = None
+        self.width = None
+        self.counts = np.zeros(numBins, dtype=np.int64)
+
+    def update(self, data):
+        self.numTotal += np.size(data)
+        self.numMasked += np.ma.count_masked(data)
+        self.numNaN += int(np.ma.filled(np.sum(np.isnan(data)), 0))
+        values = np.ma.compressed(data).astype(np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        inRange = np.ones(values.shape, dtype=bool)
+        if self.varMin is not None:
+            inRange &= values >= self.varMin
+        if self.varMax is not None:
+            inRange &= values <= self.varMax
+        self.numInRange += int(np.sum(inRange))
+        mean = np.mean(values)
+        self.addMoments(values.size, mean, np.sum((values - mean) ** 2),
+            np.min(values), np.max(values))
+        self.addToHistogram(values, np.ones(values.size, dtype=np.int64))
+
+    def merge(self, other):
+        self.numTotal += other.numTotal
+        self.numMasked += other.numMasked
+        self.numNaN += other.numNaN
+        self.numInRange += other.numInRange
+        if other.numValid == 0:
+            return
+        self.addMoments(other.numValid, other.mean, other.m2, other.min,
+            other.max)
+        if self.lo is None or (self.lo == other.lo and self.width == other.width
+            and len(self.counts) == len(other.counts)):
+            if self.lo is None:
+                self.lo = other.lo
+                self.width = other.width
+                self.counts = np.zeros_like(other.counts)
+            self.counts += other.counts
+            return
+        # Bins of other are put back at their centres, which is within one
+        # bin of the exact histogram.
+        centres = other.lo + (np.arange(len(other.counts)) + 0.5) * other.width
+        centres = np.clip(centres, other.min, other.max)
+        nonEmpty = other.counts > 0
+        self.addToHistogram(centres[nonEmpty], other.counts[nonEmpty])
+
+    def addMoments(self, num, mean, m2, vmin, vmax):
+        # Chan et al. pairwise combination of counts, means and sums of
+        # squared deviations
+        total = self.numValid + num
+        delta = mean - self.mean
+        self.mean += delta * num / total
+        self.m2 += m2 + delta ** 2 * self.numValid * num / total
+        self.numValid = total
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+
+    def addToHistogram(self, values, weights):
+        numBins = len(self.counts)
+        if self.lo is None:
+            vmin = np.min(values)
+            vmax = np.max(values)
+            self.lo = vmin
+            self.width = (vmax - vmin) / numBins if vmax > vmin \
+                else max(abs(vmin), 1.0) / numBins
+        # Double the bin width until the grid covers the values, merging
+        # pairs of bins so counts stay exact.
+        while np.min(values) < self.lo or np.max(values) > self.hi():
+            merged = self.counts[0::2] + self.counts[1::2]
+            self.counts[:] = 0
+            if np.min(values) < self.lo:
+                self.counts[numBins // 2:] = merged
+                self.lo -= numBins * self.width
+            else:
+                self.counts[:numBins // 2] = merged
+            self.width *= 2
+        index = np.clip(((values - self.lo) / self.width).astype(np.int64),
+            0, numBins - 1)
+        self.counts += np.bincount(index, weights=weights,
+            minlength=numBins).astype(np.int64)
+
+    def hi(self):
+        return self.lo + len(self.counts) * self.width
+
+    def std(self):
+        # Population standard deviation
+        return np.sqrt(self.m2 / self.numValid) if self.numValid else np.nan
+
+    def quantile(self, q):
+        # Linear interpolation inside the histogram bin holding quantile q.
+        if self.numValid == 0:
+            return np.nan
+        cumulative = np.cumsum(self.counts)
+        rank = q * self.numValid
+        k = min(int(np.searchsorted(cumulative, rank)), len(self.counts) - 1)
+        before = cumulative[k - 1] if k > 0 else 0
+        fraction = (rank - before) / self.counts[k] if self.counts[k] else 0.0
+        value = self.lo + (k + fraction) * self.width
+        return float(min(max(value, self.min), self.max))
+
+    def histogram(self, numBins=10):
+        # About numBins counts and their edges between min and max, made of
+        # whole bins of the fine histogram.
+        if self.numValid == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        first = min(int((self.min - self.lo) / self.width), len(self.counts) - 1)
+        last = min(int((self.max - self.lo) / self.width), len(self.counts) - 1)
+        step = -(-(last - first + 1) // numBins)
+        starts = np.arange(first, last + 1, step)
+        counts = np.add.reduceat(self.counts[first:last + 1], starts - first)
+        edges = self.lo + np.append(starts, last + 1) * self.width
+        edges[0] = self.min
+        edges[-1] = self.max
+        return counts, edges
+
+def summarize(var, region, varMin=None, varMax=None, progress=None,
+    maxBytes=READ_BYTES):
+# SummaryStats of a region of var, reading each chunk-aligned block once.
+# progress(blocksDone, numBlocks) is called after each block if given.
+    stats = SummaryStats(varMin, varMax)
+    numBlocks, blocks = regionBlocks(var, region, maxBytes)
+    for numDone, block in enumerate(blocks):
+        stats.update(var[block])
+        if progress:
+            progress(numDone + 1, numBlocks)
+    return stats
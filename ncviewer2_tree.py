@@ -0,0 +1,137 @@
+from PyQt5 import QtCore
+
+class TreeNode():
+# Node of the file tree. kind is "root", "globals" (global attributes
+# branch), "variables" (variables branch), "global" (a global attribute),
+# "variable" or "attribute" (a variable's attribute).
+    def __init__(self, name, kind, parent=None, row=0):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.row = row
+        # None until the children are read from the file.
+        self.children = [] if kind in ("root", "global", "attribute") else None
+
+    def key(self):
+        # Identifies the node in search results.
+        if self.kind == "attribute":
+            return (self.kind, self.parent.name, self.name)
+        return (self.kind, self.name)
+
+class NcTreeModel(QtCore.QAbstractItemModel):
+# Global attributes, variables and variable attributes of a netCDF file.
+# A node's children are only read from the file when it is expanded, so
+# opening a file doesn't depend on the number of variables or attributes.
+    def __init__(self, obj, parent=None):
+        super().__init__(parent)
+        self.obj = obj
+        self.root = TreeNode("", "root")
+        self.root.children = [
+            TreeNode("Global attributes", "globals", self.root, 0),
+            TreeNode("Variables", "variables", self.root, 1)]
+        # Lower case search names, built on the first search.
+        self.searchIndex = None
+
+    def nodeFromIndex(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def childNames(self, node):
+        # Names of a node's children and their kind, read from the file.
+        if node.kind == "globals":
+            return self.obj.ncattrs(), "global"
+        if node.kind == "variables":
+            return list(self.obj.variables), "variable"
+        return self.obj.variables[node.name].ncattrs(), "attribute"
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column,
+            self.nodeFromIndex(parent).children[row])
+
+    def parent(self, index):
+        node = self.nodeFromIndex(index)
+        if node.parent is None or node.parent is self.root:
+            return QtCore.QModelIndex()
+        return self.createIndex(node.parent.row, 0, node.parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.nodeFromIndex(parent).children or ())
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        # Unread nodes get an expand arrow without touching the file.
+        children = self.nodeFromIndex(parent).children
+        return children is None or len(children) > 0
+
+    def canFetchMore(self, parent):
+        return self.nodeFromIndex(parent).children is None
+
+    def fetchMore(self, parent):
+        node = self.nodeFromIndex(parent)
+        if node.children is not None:
+            return
+        names, kind = self.childNames(node)
+        if len(names) == 0:
+            node.children = []
+            return
+        self.beginInsertRows(parent, 0, len(names) - 1)
+        node.children = [TreeNode(name, kind, node, row)
+            for row, name in enumerate(names)]
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.DisplayRole:
+            return index.internalPointer().name
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return "This nc file:"
+        return None
+
+    def search(self, text):
+        # Keys of the nodes to show for a search text: global attributes and
+        # variable attributes whose name contains it, variables whose name
+        # or one of whose attribute names contains it, and all attributes of
+        # variables whose name contains it.
+        if self.searchIndex is None:
+            self.searchIndex = (
+                [(name.lower(), name) for name in self.obj.ncattrs()],
+                {varName: [(name.lower(), name) for name in var.ncattrs()]
+                    for varName, var in self.obj.variables.items()})
+        globalNames, variables = self.searchIndex
+        text = text.lower()
+        matches = set(("global", name) for lower, name in globalNames
+            if text in lower)
+        for varName, attrNames in variables.items():
+            if text in varName.lower():
+                attrMatches = [name for lower, name in attrNames]
+            else:
+                attrMatches = [name for lower, name in attrNames if text in lower]
+                if not attrMatches:
+                    continue
+            matches.add(("variable", varName))
+            matches.update(("attribute", varName, name) for name in attrMatches)
+        return matches
+
+class NcTreeFilter(QtCore.QSortFilterProxyModel):
+# Shows the part of an NcTreeModel matching a search text. Changing the text
+# only re-filters the rows, the model and the view are not rebuilt.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.matches = None
+
+    def setSearchText(self, text):
+        self.matches = self.sourceModel().search(text) if text else None
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        parentNode = self.sourceModel().nodeFromIndex(sourceParent)
+        if self.matches is None or parentNode.kind == "root":
+            return True
+        return parentNode.children[sourceRow].key() in self.matches
@@ -1,8 +1,11 @@
+import os
 from PyQt5 import QtGui, QtWidgets, QtCore
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.backends.backend_qt5 import NavigationToolbar2QT
 from matplotlib.figure import Figure
 
+from ncviewer2_io import layoutText
+
 class Ui_MainWindow():
     def setupUi(self, MainWindow):
         # Main window
@@ -46,12 +49,29 @@ class Ui_MainWindow():
         self.statusbar.setObjectName("statusbar")
         MainWindow.setStatusBar(self.statusbar)
 
+        # Progress and cancel button of background jobs, hidden when idle
+        self.progressBar = QtWidgets.QProgressBar()
+        self.progressBar.setObjectName("progressBar")
+        self.progressBar.setMaximumWidth(250)
+        self.progressBar.setHidden(True)
+        self.statusbar.addPermanentWidget(self.progressBar)
+
+        self.buttonCancel = QtWidgets.QPushButton("Cancel")
+        self.buttonCancel.setObjectName("buttonCancel")
+        self.buttonCancel.setHidden(True)
+        self.statusbar.addPermanentWidget(self.buttonCancel)
+
         # Menu File actions
         self.actionOpen = QtWidgets.QAction(MainWindow)
         self.actionOpen.setObjectName("actionOpen")
         self.actionOpen.setText("Open")
         self.menuFile.addAction(self.actionOpen)
 
+        self.actionOpenSeries = QtWidgets.QAction(MainWindow)
+        self.actionOpenSeries.setObjectName("actionOpenSeries")
+        self.actionOpenSeries.setText("Open time series...")
+        self.menuFile.addAction(self.actionOpenSeries)
+
         self.menuFile.addSeparator()
 
         self.actionSaveDataAsPNG = QtWidgets.QAction(MainWindow)
@@ -112,6 +132,13 @@ class Ui_MainWindow():
         self.actionCountWhere.setText("Count where...")
         self.menuStats.addAction(self.actionCountWhere)
 
+        self.menuStats.addSeparator()
+
+        self.actionSummary = QtWidgets.QAction(MainWindow)
+        self.actionSummary.setObjectName("actionSummary")
+        self.actionSummary.setText("Summary...")
+        self.menuStats.addAction(self.actionSummary)
+
         # Menu Visualize actions
         self.actionToggleGraph = QtWidgets.QAction(MainWindow)
         self.actionToggleGraph.setObjectName("actionToggleGraph")
@@ -146,14 +173,25 @@ class Ui_MainWindow():
         # Size policy for some widgets
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
 
-        # Treeview
-        self.treeWidget = QtWidgets.QTreeWidget()
+        # Treeview with a search box on top
+        self.treePanel = QtWidgets.QWidget()
         sizePolicy.setHorizontalStretch(1)
-        self.treeWidget.setSizePolicy(sizePolicy)
-        self.treeWidget.setObjectName("treeView")
-        self.treeWidget.setColumnCount(1)
-        self.treeWidget.setHeaderLabel("This nc file:")
-        self.gridLayout.addWidget(self.treeWidget,0,0,2,1)
+        self.treePanel.setSizePolicy(sizePolicy)
+        self.treeLayout = QtWidgets.QVBoxLayout()
+        self.treeLayout.setContentsMargins(0, 0, 0, 0)
+        self.treePanel.setLayout(self.treeLayout)
+        self.gridLayout.addWidget(self.treePanel,0,0,2,1)
+
+        self.lineEditSearch = QtWidgets.QLineEdit()
+        self.lineEditSearch.setObjectName("lineEditSearch")
+        self.lineEditSearch.setPlaceholderText("Search variables and attributes")
+        self.lineEditSearch.setClearButtonEnabled(True)
+        self.treeLayout.addWidget(self.lineEditSearch)
+
+        self.treeView = QtWidgets.QTreeView()
+        self.treeView.setObjectName("treeView")
+        self.treeView.setUniformRowHeights(True)
+        self.treeLayout.addWidget(self.treeView)
 
         # Welcome label
         self.welcomeLabel = QtWidgets.QLabel()
@@ -216,12 +254,17 @@ class Ui_CountMaskedOrNaN():
         self.comboBoxSelectVar.addItems(data.varNames)
         self.gridLayout.addWidget(self.comboBoxSelectVar,0,1)
 
-        self.labelSubset = QtWidgets.QLabel("Subset " +
-            str(data.obj.variables[self.comboBoxSelectVar.currentText()].dimensions))
+        var = data.obj.variables[self.comboBoxSelectVar.currentText()]
+        self.labelSubset = QtWidgets.QLabel("Subset " + str(var.dimensions)
+            + "\n" + layoutText(var))
         self.gridLayout.addWidget(self.labelSubset,1,0)
 
         self.lineEditSubset = QtWidgets.QLineEdit("(start, end, ...)")
         self.lineEditSubset.setObjectName("lineEditSubset")
+        self.lineEditSubset.setToolTip("Index ranges: start, end, ... for "
+            "every dimension\nor start:stop:step for every dimension: 0, :, ::4"
+            "\nor coordinate values: time=2000-01-01..2000-01-31, "
+            "lat=-10..10..2, lon=120")
         self.gridLayout.addWidget(self.lineEditSubset,1,1)
 
 class Ui_CountWhere(Ui_CountMaskedOrNaN):
@@ -436,6 +479,21 @@ class Ui_SIED():
         self.hSliderCohesionThrBoth.setTickPosition(QtWidgets.QSlider.TicksBelow)
         self.verticalLayout.addWidget(self.hSliderCohesionThrBoth)
 
+        self.labelNumThreads = QtWidgets.QLabel("Number of threads: 1")
+        self.verticalLayout.addWidget(self.labelNumThreads)
+
+        self.hSliderNumThreads = QtWidgets.QSlider(QtCore.Qt.Horizontal, Window)
+        self.hSliderNumThreads.setObjectName("hSliderNumThreads")
+        self.hSliderNumThreads.setMinimum(1)
+        self.hSliderNumThreads.setMaximum(os.cpu_count() or 1)
+        self.hSliderNumThreads.setTickPosition(QtWidgets.QSlider.TicksBelow)
+        self.verticalLayout.addWidget(self.hSliderNumThreads)
+
+        self.checkBoxMultiScale = QtWidgets.QCheckBox(
+            "Coarse-to-fine (refine only candidate regions)", Window)
+        self.checkBoxMultiScale.setObjectName("checkBoxMultiScale")
+        self.verticalLayout.addWidget(self.checkBoxMultiScale)
+
         self.buttonResetPara = QtWidgets.QPushButton(text="Reset parameters",
             parent=Window)
         self.buttonResetPara.setObjectName("buttonResetPara")